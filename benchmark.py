@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""Benchmarks of CorporateRL's hot paths.
+
+Every workload is seeded, so consecutive runs measure the same work. Results
+are printed (or written) as JSON, and may be compared with a baseline file
+to catch regressions:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import entities
+import environment
+import interface
+import level_cache
+import levels
+import main
+import saves
+
+
+class FakeWindow():
+    """Window implementing the part of the curses window's interface used
+    by Interface, without drawing anything."""
+
+    def __init__(self, height=levels.SCREEN_HEIGHT, width=levels.GAME_WIDTH):
+        self.height = height
+        self.width = width
+        self.calls = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def addstr(self, y, x, text, attribute=0):
+        self.calls += 1
+
+    def move(self, y, x):
+        pass
+
+    def refresh(self):
+        pass
+
+
+class FakeInterface(interface.Interface):
+    """Interface drawing into a FakeWindow, without setting up curses."""
+
+    def prepare_curses(self):
+        pass
+
+    def color_attribute(self, color):
+        return color
+
+
+def measure(function, repeat):
+    """Run the function a few times and take the fastest run, which is the
+    least disturbed by the rest of the system.
+
+    Args:
+        function (callable): the workload, called without arguments.
+        repeat (int): number of runs.
+    Returns:
+        The shortest time of a run, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def result(seconds, operations, unit):
+    """Describe the measured time of the given number of operations."""
+    return {"seconds": seconds, "operations": operations, "unit": unit,
+            "per_second": operations / seconds if seconds else None}
+
+
+def new_game(seed, height=levels.GAME_HEIGHT, width=levels.GAME_WIDTH):
+    """Start a headless game with the given seed."""
+    game = main.Game(seed=seed, height=height, width=width)
+    game.start(interface.NullInterface())
+    return game
+
+
+def bench_generation(repeat, seeds):
+    """Generate levels of a few sizes, with many seeds."""
+    results = {}
+    player = entities.Player(0, 0)
+    for height, width in ((22, 80), (44, 160), (88, 320)):
+        def generate():
+            for seed in range(seeds):
+                levels.Level(1, player, seed=seed, height=height, width=width)
+
+        results["generation_{}x{}".format(height, width)] = result(
+            measure(generate, repeat), seeds, "levels")
+    return results
+
+
+def bench_level_cache(repeat, seeds):
+    """Load cached levels, to compare with their generation."""
+    player = entities.Player(0, 0)
+    records = [level_cache.generate(seed, 1) for seed in range(seeds)]
+
+    def load():
+        for record in records:
+            saves.loads_level(record, player)
+
+    return {"level_cache_load": result(measure(load, repeat), seeds,
+                                       "levels")}
+
+
+def bench_ticks(repeat, ticks):
+    """Run turns of a level with 10, 100 and 1000 zombies."""
+    results = {}
+    for zombies_n in (10, 100, 1000):
+        game = new_game(0, height=44, width=160)
+        level = game.current_level
+        level.remove_creatures(list(level.npcs.handles))
+
+        rng = random.Random(zombies_n)
+        floor = [(y, x) for y in range(level.height)
+                 for x in range(level.width)
+                 if level.terrain[y][x] == levels.FLOOR
+                 and (y, x) != (game.player.y, game.player.x)]
+        for y, x in rng.sample(floor, min(zombies_n, len(floor))):
+            level.add_creature(entities.CorporateZombie(y, x, rng=rng))
+        game.player.max_hp = game.player.hp = 10 ** 9
+        snapshot = game.snapshot()
+
+        def tick():
+            game.restore(snapshot)
+            for _ in range(ticks):
+                game.world_tick()
+                game.check_world_status()
+
+        results["tick_{}_zombies".format(zombies_n)] = result(
+            measure(tick, repeat), ticks, "turns")
+    return results
+
+
+def bench_explosions(repeat):
+    """Set off a chain of bombs covering the whole level."""
+    game = new_game(0, height=88, width=320)
+    level = game.current_level
+    for y in range(0, level.height, 2):
+        for x in range(0, level.width, 2):
+            level.put_bomb(y, x)
+    bombs_n = len(level.bombs)
+    first = level.bombs[0]
+    snapshot = game.snapshot()
+
+    def explode():
+        game.restore(snapshot)
+        level.explosion(first)
+
+    return {"explosion_chain": result(measure(explode, repeat), bombs_n,
+                                      "bombs")}
+
+
+def bench_draw(repeat, frames):
+    """Draw frames of a level walked around by the player."""
+    game = new_game(0)
+    for room in game.current_level.rooms:
+        game.current_level.set_visibility(room, True, 1)
+    snapshot = game.snapshot()
+    rng = random.Random(0)
+    moves = [rng.choice("hjklyunv") for _ in range(frames)]
+
+    def draw():
+        game.restore(snapshot)
+        game.interface = FakeInterface(FakeWindow())
+        for move in moves:
+            game.interpret_input(move)
+            game.draw()
+
+    seconds = measure(draw, repeat)
+    return {"draw": result(seconds, frames, "frames")}
+
+
+def bench_episodes(repeat, episodes, max_steps):
+    """Play whole headless episodes with random actions."""
+    steps = []
+
+    def play():
+        env = environment.CorporateEnv()
+        rng = random.Random(0)
+        steps.clear()
+        for seed in range(episodes):
+            env.reset(seed)
+            for _ in range(max_steps):
+                action = rng.randrange(len(environment.ACTIONS))
+                steps.append(action)
+                if env.step(action)[2]:
+                    break
+
+    seconds = measure(play, repeat)
+    return {"episodes": result(seconds, episodes, "episodes"),
+            "episode_steps": result(seconds, len(steps), "steps")}
+
+
+def run(quick=False):
+    """Run all benchmarks.
+
+    Args:
+        quick (boolean): whether to run smaller workloads, e.g. to check the
+            benchmarks work.
+    Returns:
+        Dictionary mapping names of the benchmarks to their results.
+    """
+    repeat = 1 if quick else 5
+    results = {}
+    results.update(bench_generation(repeat, seeds=2 if quick else 20))
+    results.update(bench_level_cache(repeat, seeds=2 if quick else 20))
+    results.update(bench_ticks(repeat, ticks=5 if quick else 50))
+    results.update(bench_explosions(repeat))
+    results.update(bench_draw(repeat, frames=20 if quick else 200))
+    results.update(bench_episodes(repeat, episodes=2 if quick else 10,
+                                  max_steps=200))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Find the benchmarks which got slower than in the baseline.
+
+    Args:
+        results (dict): the current results.
+        baseline (dict): results of an earlier run.
+        tolerance (float): allowed slowdown, e.g. 0.2 for 20%.
+    Returns:
+        List of messages describing the regressions.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or not previous["per_second"]:
+            continue
+        ratio = current["per_second"] / previous["per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append("{}: {:.1f} -> {:.1f} {}/s ({:+.0%})".format(
+                name, previous["per_second"], current["per_second"],
+                current["unit"], ratio - 1))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true",
+                        help="run smaller workloads")
+    parser.add_argument("--output", help="write the results to the file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="fail if slower than the results in the file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "quick": args.quick,
+              "results": run(args.quick)}
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(report["results"], baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression:", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
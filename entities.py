@@ -1,9 +1,8 @@
 """Entity (NPCs, PC, bombs) implementation for CorporateRL game."""
-import math
+import functools
 import random
 
 import misc
-from misc import debug
 
 
 class Entity(misc.GameObject):
@@ -15,6 +14,7 @@ class Entity(misc.GameObject):
         hp (int): the current value of health points.
         max_damage (int): the maximum damage the entity may inflict.
     """
+    __slots__ = ("char", "hp", "max_damage")
 
     def __init__(self, y, x, char):
         """Creates an entity, sets its hp and damage.
@@ -29,9 +29,25 @@ class Entity(misc.GameObject):
         self.hp = 0
         self.max_damage = 0
 
-    def damage(self):
-        """Get a random number of inflicted damage points."""
-        return random.randint(1, self.max_damage)
+    def damage(self, rng=random):
+        """Get a random number of inflicted damage points.
+
+        Args:
+            rng (Random): random numbers generator to roll the damage with.
+        """
+        return rng.randint(1, self.max_damage)
+
+    def move(self, y, x):
+        """Moves the entity to a point on the map. Entities placed in a level
+        should be moved with Level.move_creature, which keeps the level's
+        occupancy index up to date.
+
+        Args:
+            y (int): target vertical position.
+            x (int): target horizontal position.
+        """
+        self.y = y
+        self.x = x
 
 
 class Player(Entity):
@@ -41,6 +57,8 @@ class Player(Entity):
         max_hp (int): The maximum (initial) number of player health points.
         bombs_n (int): Number of points in player's possesion.
     """
+    __slots__ = ("max_hp", "bombs_n")
+
     def __init__(self, y, x):
         """Creates the player, sets its statistics."""
         super().__init__(y, x, "@")
@@ -49,26 +67,6 @@ class Player(Entity):
         self.reset()
         self._color = 6
 
-    def move_relative(self, y_diff, x_diff):
-        """Moves the player character relative to its current location.
-
-        Args:
-            y_diff (int): vertical distance to move.
-            x_diff (int): horizontal distance to move.
-        """
-        self.y += y_diff
-        self.x += x_diff
-
-    def move(self, y, x):
-        """Moves the player character to a point on the map.
-
-        Args:
-            y (int): target vertical position.
-            x (int): target horizontal position.
-        """
-        self.y = y
-        self.x = x
-
     def reset(self):
         """Resets player's attributes (HP and number of bombs)."""
         self.hp = self.max_hp
@@ -79,53 +77,47 @@ class CorporateZombie(Entity):
     """Class representing the most common and the simplest enemy. It's not very
     smart and powerful, but still very dangerous in large groups.
 
+    Once added to a level, the zombie is kept in the level's NPCStore. Its
+    moves are decided by NPCStore.plan_moves, together with the other NPCs.
+
     Attributes:
         exp_worth (int): The amount of experience points the player gets after
             defating the monster. Currently unused.
+        index (int): the zombie's slot in the store, -1 if it isn't in one.
     """
+    __slots__ = ("index", "exp_worth")
 
-    def __init__(self, y, x):
-        """Creates the zombie, sets up some values."""
+    def __init__(self, y, x, rng=random):
+        """Creates the zombie, sets up some values.
+
+        Args:
+            y, x (ints): position of the zombie.
+            rng (Random): random numbers generator to roll the hp with.
+        """
         super().__init__(y, x, "Z")
-        self.hp = random.randint(3, 5)
+        self.index = -1
+        self.hp = rng.randint(3, 5)
         self.max_damage = 2
         self.exp_worth = 2
         self._color = 5
 
-    def make_action(self, field_of_view):
-        """Makes a decision where the zombie should move to.
 
-        If the player is in the same room as the zombie, it will walk towards
-        him. Otherwise it will just roam around randomly.
+@functools.lru_cache(maxsize=None)
+def blast_stencil(radius):
+    """Get the offsets of all tiles caught in an explosion of the given range.
 
-        Args:
-            field_of_view (list): List of all entities which the NPC sees at
-                the given moment.
+    Stencils are computed once per range and shared by all bombs.
 
-        Returns:
-            Two integers representing the vertical and horizontal position
-                after the move.
-        """
-        player = None
-        for obj in field_of_view:
-            if isinstance(obj, Player):
-                player = obj
-                break
-
-        if player:
-            distance_x = player.x - self.x
-            distance_y = player.y - self.y
-
-            delta_x = misc.sign(distance_x)
-            delta_y = misc.sign(distance_y)
-
-        else:
-            delta_y, delta_x = random.randint(-1, 1), random.randint(-1, 1)
-
-        new_y = self.y + delta_y
-        new_x = self.x + delta_x
-
-        return new_y, new_x
+    Args:
+        radius (int): range of the explosion.
+    Returns:
+        Tuple of offsets (delta_y, delta_x) from the bomb's position.
+    """
+    reach = int(radius)
+    return tuple((delta_y, delta_x)
+                 for delta_y in range(-reach, reach + 1)
+                 for delta_x in range(-reach, reach + 1)
+                 if delta_y * delta_y + delta_x * delta_x <= radius * radius)
 
 
 class Bomb(Entity):
@@ -137,6 +129,7 @@ class Bomb(Entity):
         range (int): all tiles in that distance will be caught in the bomb's
             explosion.
     """
+    __slots__ = ("time_till_blow", "range", "exp_worth")
 
     def __init__(self, y, x):
         """Creates the bomb and sets up default explosion values."""
@@ -147,7 +140,7 @@ class Bomb(Entity):
         self.time_till_blow = 6
         self.range = 2
 
-    def damage(self):
+    def damage(self, rng=random):
         """Returns 0, because bomb doesn't do damage on touch."""
         return 0
 
@@ -175,12 +168,14 @@ class Bomb(Entity):
 
         delta_y = self.y - y
         delta_x = self.x - x
+        return delta_y * delta_y + delta_x * delta_x <= self.range * self.range
 
-        distance = math.sqrt(delta_y * delta_y + delta_x * delta_x)
-        debug("Dystans", distance, self.range)
-        return distance <= self.range
+    @property
+    def stencil(self):
+        """Offsets of the tiles caught in the explosion, see blast_stencil."""
+        return blast_stencil(self.range)
 
-    def make_action(self, field_of_view):
+    def make_action(self):
         """Makes the bomb fuse shorter.
 
         Returns:
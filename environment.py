@@ -0,0 +1,129 @@
+"""Headless, curses-free environment for running CorporateRL by agents.
+
+The environment follows the Gym conventions - reset() starts a new episode and
+step(action) advances the game by one player turn.
+"""
+import operator
+
+import entities
+import interface
+import main
+import observation
+
+
+ACTIONS = main.ACTIONS
+
+REWARD_KILL = 1
+REWARD_DESCEND = 10
+REWARD_DEATH = -10
+
+
+class CorporateEnv:
+    """Class representing the game as an environment for agents.
+
+    Attributes:
+        game (Game): the game being played, None before the first reset.
+        turn (int): number of steps taken in the current episode.
+        level_cache (LevelCache): cache the levels are loaded from, None to
+            generate them.
+    """
+
+    def __init__(self, level_cache=None):
+        """Creates the environment, reset has to be called before stepping.
+
+        Args:
+            level_cache (LevelCache): cache to load the levels from, e.g.
+                when evaluating on the same episodes many times.
+        """
+        self.game = None
+        self.turn = 0
+        self.level_cache = level_cache
+
+    def reset(self, seed=None):
+        """Starts a new episode.
+
+        Args:
+            seed (int): seed of the game, None for a random episode. The
+                same seed and actions give the same episode.
+        Returns:
+            The first observation of the episode.
+        """
+        self.game = main.Game(seed=seed, level_cache=self.level_cache)
+        self.game.start(interface.NullInterface())
+        self.turn = 0
+
+        # The same order as in Game.main_loop - the world moves first.
+        self.game.world_tick()
+        self.game.check_world_status()
+        return self.observation()
+
+    def step(self, action):
+        """Makes one player turn and lets the world react to it.
+
+        Args:
+            action (int or str): index in ACTIONS (any integer type, e.g.
+                an element of a NumPy array) or the key itself.
+        Returns:
+            Tuple (observation, reward, done, info).
+        Raises:
+            ValueError: if the action isn't one of ACTIONS - other keys
+                (e.g. saving or running) don't take a single turn.
+        """
+        if not isinstance(action, str):
+            code = operator.index(action)
+            if not 0 <= code < len(ACTIONS):
+                raise ValueError("Unknown action: {}".format(code))
+            action = ACTIONS[code]
+        elif action not in ACTIONS:
+            raise ValueError("Unknown action: {!r}".format(action))
+
+        game = self.game
+        level_num = game.level_num
+        zombies = self.count_zombies()
+
+        game.interpret_input(action)
+        game.world_tick()
+        game.check_world_status()
+        self.turn += 1
+
+        reward = 0
+        if game.level_num != level_num:
+            reward += REWARD_DESCEND
+        else:
+            reward += REWARD_KILL * (zombies - self.count_zombies())
+
+        done = game.player.hp <= 0
+        if done:
+            reward += REWARD_DEATH
+
+        info = {"level_num": game.level_num, "turn": self.turn,
+                "message": game.interface.player_message}
+        game.interface.player_message = ""
+        return self.observation(), reward, done, info
+
+    def count_zombies(self):
+        """Get the number of living zombies in the current level."""
+        return sum(1 for creature in self.game.current_level.creatures
+                   if isinstance(creature, entities.CorporateZombie))
+
+    def observation(self):
+        """Get the observation of the current game state.
+
+        Returns:
+            Dictionary with player's statistics and the "grid" - memoryview of
+            shape (channels, height, width) described in ObservationEncoder.
+            The grid isn't a copy, it changes with the next step. It covers
+            the whole level, agents which should only know what the player
+            has seen have to mask it with the "visible" channel.
+        """
+        game = self.game
+        level = game.current_level
+        if level.encoder is None:
+            level.attach_encoder(observation.ObservationEncoder(
+                level.height, level.width))
+
+        return {"grid": level.observe(),
+                "player": (game.player.y, game.player.x),
+                "hp": game.player.hp,
+                "bombs": game.player.bombs_n,
+                "level_num": game.level_num}
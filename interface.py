@@ -1,8 +1,13 @@
 """Interface support for CorporateRL game."""
 import curses
+
+import profiler
 from misc import debug
 
 
+BLANK = (" ", 0)
+
+
 class Interface():
     """Class representing the curses interface, it's meant to be easily
     replaces with another type of interface.
@@ -11,9 +16,17 @@ class Interface():
         window: curses window in which the game will be displayed.
         shift_y, shift_x (ints): the shift of the game in the window
             so that important interface elements can be displayed.
+        view_height, view_width (ints): size of the part of the window
+            showing the level.
+        camera_y, camera_x (ints): position in the level shown in the top left
+            corner of the view.
         player_message (str): message to the player to be displayed in the next
             refresh.
         player_status (str): status of the player (HP and other).
+        frame (list): A 2D array of (char, color) pairs - the frame being
+            composed, sent to curses on the next refresh.
+        screen (list): A 2D array of (char, color) pairs - what curses
+            currently displays, None for unknown cells.
     """
 
     def __init__(self, window):
@@ -23,16 +36,24 @@ class Interface():
             window (curses object): a window to display the game.
         """
         self.window = window
-        self.height = 24
-        self.width = 80
+        self.height, self.width = window.getmaxyx()
         self.prepare_curses()
 
         self.shift_y = 1
         self.shift_x = 0
 
+        # One line for the messages above and one for the status below.
+        self.view_height = self.height - 2
+        self.view_width = self.width
+        self.camera_y = 0
+        self.camera_x = 0
+
         self.player_message = ""
         self.player_status = ""
 
+        self.frame = [[BLANK] * self.width for _ in range(self.height)]
+        self.screen = [[None] * self.width for _ in range(self.height)]
+
     def set_player_status(self, status):
         """Sets the player status.
 
@@ -53,15 +74,59 @@ class Interface():
         curses.init_pair(5, 35, 0)
         curses.init_pair(6, 21, 0)
 
+    def color_attribute(self, color):
+        """Get the curses attribute drawing in the given color pair."""
+        return curses.color_pair(color)
 
     def clear_screen(self):
-        """Clear the screen, delete all existing characters."""
-        for y in range(self.height):
-            for x in range(self.width):
-                self.window.addch(y, x, " ")
+        """Clear the frame, delete all existing characters. Nothing is sent to
+        curses until the next refresh."""
+        self.frame = [[BLANK] * self.width for _ in range(self.height)]
+
+    @staticmethod
+    def _follow(camera, center, view, size):
+        """Get the camera position along one axis, moving the camera only if
+        the center gets too close to the view's edge.
+
+        Args:
+            camera (int): current camera position.
+            center (int): position to keep in view.
+            view (int): size of the view.
+            size (int): size of the level.
+        Returns:
+            New camera position.
+        """
+        margin = view // 4
+        if center < camera + margin or center >= camera + view - margin:
+            camera = center - view // 2
+        return max(0, min(camera, size - view))
+
+    def focus(self, center_y, center_x, map_height, map_width):
+        """Point the camera at the given position of the level.
+
+        Args:
+            center_y, center_x (ints): position to keep in view.
+            map_height, map_width (ints): dimensions of the level.
+        Returns:
+            The part of the level in view: top, left, bottom and right edges,
+            bottom and right excluded.
+        """
+        self.camera_y = self._follow(self.camera_y, center_y,
+                                     self.view_height, map_height)
+        self.camera_x = self._follow(self.camera_x, center_x,
+                                     self.view_width, map_width)
+        return (self.camera_y, self.camera_x,
+                min(map_height, self.camera_y + self.view_height),
+                min(map_width, self.camera_x + self.view_width))
+
+    def in_view(self, y, x):
+        """Check whether the given position of the level is in view."""
+        return (0 <= y - self.camera_y < self.view_height and
+                0 <= x - self.camera_x < self.view_width)
 
     def draw_tile(self, y, x, obj_):
-        """Draw the object at the given position.
+        """Draw the object at the given position of the level, which has to
+        be in view.
 
         Args:
             y (int): vertical position of the tile
@@ -69,10 +134,8 @@ class Interface():
             obj_ (GameObject): object to draw.
         """
         assert len(obj_.char) == 1
-        color_pair = curses.color_pair(obj_.color)
-        self.window.addstr(y + self.shift_y,
-                           x + self.shift_x,
-                           obj_.char, color_pair)
+        self.frame[y - self.camera_y + self.shift_y][
+            x - self.camera_x + self.shift_x] = (obj_.char, obj_.color)
 
     def draw_object(self, obj_):
         """Draw the whole object (possibly multiple tiles).
@@ -82,7 +145,8 @@ class Interface():
         """
         for y in range(obj_.y, obj_.y + obj_.h):
             for x in range(obj_.x, obj_.x + obj_.w):
-                self.draw_tile(y, x, obj_)
+                if self.in_view(y, x):
+                    self.draw_tile(y, x, obj_)
 
     def draw_explosion(self, exploded):
         """Draw the explosion with some nice red colors.
@@ -90,10 +154,10 @@ class Interface():
         Args:
             exploded (list): list of exploded positions (y, x).
         """
-        explosion_color = curses.color_pair(4)
         for (y, x) in exploded:
-            self.window.addstr(y + self.shift_y, x + self.shift_x,
-                               " ", explosion_color)
+            if self.in_view(y, x):
+                self.frame[y - self.camera_y + self.shift_y][
+                    x - self.camera_x + self.shift_x] = (" ", 4)
 
     def get_user_input(self):
         """Get the input from the user (keyboard)."""
@@ -116,18 +180,116 @@ class Interface():
             y (int): number of the line on the screen to display in.
             message (str): message to be displayed.
         """
-        for x in range(0, 80):
-            self.window.addch(y, x, " ")
-        self.window.addstr(y, 0, message)
+        message = message.expandtabs()[:self.width]
+        row = [(char, 0) for char in message]
+        row += [BLANK] * (self.width - len(row))
+        self.frame[y] = row
+
+    def flush(self):
+        """Send the cells which changed since the last refresh to curses.
+
+        Consecutive changed cells of the same color in a row are written with
+        a single call.
+        """
+        calls = 0
+        for y in range(self.height):
+            frame_row = self.frame[y]
+            screen_row = self.screen[y]
+            x = 0
+            while x < self.width:
+                cell = frame_row[x]
+                if cell == screen_row[x]:
+                    x += 1
+                    continue
+
+                start = x
+                chars = []
+                color = cell[1]
+                while (x < self.width and frame_row[x] != screen_row[x]
+                       and frame_row[x][1] == color):
+                    chars.append(frame_row[x][0])
+                    screen_row[x] = frame_row[x]
+                    x += 1
+
+                calls += 1
+                try:
+                    self.window.addstr(y, start, "".join(chars),
+                                       self.color_attribute(color))
+                except curses.error:
+                    # Writing the bottom-right cell moves the cursor past the
+                    # end of the window, the character is drawn anyway.
+                    if y != self.height - 1 or x != self.width:
+                        raise
+        profiler.count("curses calls", calls)
 
     def refresh_and_center(self, center_y, center_x):
         """Refresh the screen and center the cursos on the given position.
 
         Args:
-            center_y, center_x (ints): position to recenter on.
+            center_y, center_x (ints): position in the level to recenter on.
         """
         self.display_message(0, self.player_message)
         self.player_message = ""
         self.display_message(self.height - 1, self.player_status)
-        self.window.move(center_y + self.shift_y, center_x + self.shift_x)
+        self.flush()
+        self.window.move(center_y - self.camera_y + self.shift_y,
+                         center_x - self.camera_x + self.shift_x)
         self.window.refresh()
+        profiler.count("curses calls", 2)
+
+
+class NullInterface(Interface):
+    """Interface which displays nothing and doesn't touch curses at all, used
+    to run the game headless (e.g. by agents).
+
+    Messages and status are still stored, so they may be inspected.
+    """
+
+    def __init__(self):
+        """Initializes the interface without any window."""
+        self.window = None
+        self.height = 0
+        self.width = 0
+        self.shift_y = 1
+        self.shift_x = 0
+        self.view_height = 0
+        self.view_width = 0
+        self.camera_y = 0
+        self.camera_x = 0
+
+        self.player_message = ""
+        self.player_status = ""
+
+        self.frame = []
+        self.screen = []
+
+    def prepare_curses(self):
+        """Nothing to prepare."""
+
+    def clear_screen(self):
+        """Nothing to clear."""
+
+    def focus(self, center_y, center_x, map_height, map_width):
+        """Nothing is in view."""
+        return 0, 0, 0, 0
+
+    def draw_tile(self, y, x, obj_):
+        """Nothing is drawn."""
+
+    def draw_explosion(self, exploded):
+        """Nothing is drawn."""
+
+    def get_user_input(self):
+        """There is no user to ask, the input has to be passed to
+        Game.interpret_input directly."""
+        raise RuntimeError("NullInterface can't get user input!")
+
+    def display_message(self, y, message):
+        """Nothing is displayed."""
+
+    def flush(self):
+        """Nothing is sent anywhere."""
+
+    def refresh_and_center(self, center_y, center_x):
+        """Forget the message, as if it was displayed."""
+        self.player_message = ""
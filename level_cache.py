@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""Cache of generated CorporateRL levels, kept in memory and on the disk.
+
+A level depends only on the game's seed, its number and its dimensions (see
+Game.create_level), so runs playing the same games over and over - e.g.
+evaluation episodes - may load their levels instead of generating them. The
+levels are kept as level records (see saves.dumps_level), each of them loaded
+into a new Level object, which plays out exactly as the generated one.
+
+The cache may be filled in advance, generating the levels on all cores:
+
+    python level_cache.py corporate-levels --seeds 1000 --levels 5
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+
+import entities
+import levels
+import saves
+
+
+CACHE_DIRECTORY = "corporate-levels"
+EXTENSION = ".lvl"
+MAX_MEMORY = 64 * 2 ** 20
+MAX_DISK = 1024 * 2 ** 20
+
+
+def generate(seed, level_num, height=levels.GAME_HEIGHT,
+             width=levels.GAME_WIDTH):
+    """Generate the level of the game, as Game.create_level does.
+
+    Args:
+        seed (int): seed of the game.
+        level_num (int): number of the level.
+        height, width (ints): dimensions of the level.
+    Returns:
+        The level record, see saves.dumps_level.
+    """
+    level = levels.Level(level_num, entities.Player(0, 0),
+                         seed=levels.level_seed(seed, level_num),
+                         height=height, width=width)
+    return saves.dumps_level(level)
+
+
+class LevelCache():
+    """Class keeping the least recently used levels in memory and on the
+    disk, within the given sizes. Levels which aren't in the cache are
+    generated and added to it.
+
+    The cache may be shared by threads (e.g. the one prefetching the next
+    level) and, through the directory, by processes.
+
+    Attributes:
+        directory (str): directory the levels are kept in, None to keep them
+            only in memory.
+        height, width (ints): dimensions of the cached levels.
+        max_memory (int): maximum total size of the levels in memory, in
+            bytes.
+        max_disk (int): maximum total size of the levels in the directory,
+            in bytes.
+        hits (int): number of levels found in the cache.
+        misses (int): number of levels generated by the cache.
+    """
+
+    def __init__(self, directory=None, height=levels.GAME_HEIGHT,
+                 width=levels.GAME_WIDTH, max_memory=MAX_MEMORY,
+                 max_disk=MAX_DISK):
+        """Creates the cache, with the levels left in the directory by earlier
+        runs.
+
+        Args:
+            directory (str): directory of the levels, created if it doesn't
+                exist.
+            height, width (ints): dimensions of the levels.
+            max_memory, max_disk (ints): bounds of the cache's size in bytes.
+        """
+        self.directory = directory
+        self.height = height
+        self.width = width
+        self.max_memory = max_memory
+        self.max_disk = max_disk
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_size = sum(size for _, _, size in self._disk_files())
+
+    def path(self, seed, level_num):
+        """Get the path of the file keeping the given level."""
+        return os.path.join(self.directory, "{}-{}-{}x{}{}".format(
+            seed, level_num, self.height, self.width, EXTENSION))
+
+    def __contains__(self, key):
+        seed, level_num = key
+        return key in self._memory or (
+            self.directory is not None
+            and os.path.exists(self.path(seed, level_num)))
+
+    def get(self, seed, level_num, player):
+        """Get the level of the game, from the cache if it's there.
+
+        Args:
+            seed (int): seed of the game.
+            level_num (int): number of the level.
+            player (Player): the player character.
+        Returns:
+            A new Level, see Game.create_level.
+        """
+        data = self.fetch(seed, level_num)
+        if data is not None:
+            try:
+                level = saves.loads_level(data, player)
+            except ValueError:
+                # Left by an older version of the game.
+                self.discard(seed, level_num)
+            else:
+                with self._lock:
+                    self.hits += 1
+                return level
+
+        with self._lock:
+            self.misses += 1
+        data = generate(seed, level_num, self.height, self.width)
+        self.put(seed, level_num, data)
+        return saves.loads_level(data, player)
+
+    def fetch(self, seed, level_num):
+        """Get the record of the level, if it's in the cache.
+
+        Returns:
+            The level record, see saves.dumps_level, None if the level isn't
+            cached.
+        """
+        key = (seed, level_num)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+            if self.directory is None:
+                return None
+
+            path = self.path(seed, level_num)
+            try:
+                with open(path, "rb") as level_file:
+                    data = level_file.read()
+                # The modification time marks the last use of the file.
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+            self._remember(key, data)
+            return data
+
+    def put(self, seed, level_num, data):
+        """Add the level record to the cache, evicting the least recently
+        used levels if the cache gets too big.
+
+        Args:
+            seed (int): seed of the game.
+            level_num (int): number of the level.
+            data (bytes): the level record.
+        """
+        with self._lock:
+            self._remember((seed, level_num), data)
+            if self.directory is None:
+                return
+
+            path = self.path(seed, level_num)
+            # Written aside and renamed, so that other processes never read
+            # a partially written level.
+            temporary_path = "{}.{}.tmp".format(path, os.getpid())
+            with open(temporary_path, "wb") as level_file:
+                level_file.write(data)
+            os.replace(temporary_path, path)
+            self._disk_size += len(data)
+            if self._disk_size > self.max_disk:
+                self._evict_disk()
+
+    def discard(self, seed, level_num):
+        """Remove the level from the cache, if it's there."""
+        key = (seed, level_num)
+        with self._lock:
+            data = self._memory.pop(key, None)
+            if data is not None:
+                self._memory_size -= len(data)
+            if self.directory is not None:
+                path = self.path(seed, level_num)
+                try:
+                    self._disk_size -= os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _remember(self, key, data):
+        """Keep the level record in memory, evicting the least recently used
+        ones above max_memory."""
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.max_memory and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _disk_files(self):
+        """Get the level files in the directory.
+
+        Returns:
+            List of tuples (last use, path, size).
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(EXTENSION) and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        return files
+
+    def _evict_disk(self):
+        """Remove the least recently used level files, down to three
+        quarters of max_disk, so that eviction doesn't run on every write.
+        The size is recounted, as other processes may share the
+        directory."""
+        files = sorted(self._disk_files())
+        self._disk_size = sum(size for _, _, size in files)
+        for _, path, size in files:
+            if self._disk_size <= self.max_disk * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._disk_size -= size
+
+    def pregenerate(self, seeds, level_nums, processes=None):
+        """Generate the levels which aren't in the cache yet, in parallel.
+
+        Args:
+            seeds (iterable): seeds of the games.
+            level_nums (iterable): numbers of the levels of every game.
+            processes (int): number of worker processes, by default one per
+                core.
+        Returns:
+            Number of generated levels.
+        """
+        keys = [key for key in itertools.product(seeds, level_nums)
+                if key not in self]
+        if not keys:
+            return 0
+
+        processes = processes or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            records = executor.map(
+                generate, [seed for seed, _ in keys],
+                [level_num for _, level_num in keys],
+                itertools.repeat(self.height), itertools.repeat(self.width),
+                chunksize=max(1, len(keys) // (4 * processes)))
+            for (seed, level_num), data in zip(keys, records):
+                self.put(seed, level_num, data)
+        return len(keys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", default=CACHE_DIRECTORY,
+                        help="directory of the cache")
+    parser.add_argument("--seeds", type=int, default=100,
+                        help="number of pregenerated games")
+    parser.add_argument("--first-seed", type=int, default=0,
+                        help="seed of the first pregenerated game")
+    parser.add_argument("--levels", type=int, default=3,
+                        help="number of levels of every game")
+    parser.add_argument("--height", type=int, default=levels.GAME_HEIGHT,
+                        help="height of the levels")
+    parser.add_argument("--width", type=int, default=levels.GAME_WIDTH,
+                        help="width of the levels")
+    parser.add_argument("--max-disk", type=int, default=MAX_DISK,
+                        help="maximum size of the cache in bytes")
+    parser.add_argument("--processes", type=int,
+                        help="number of worker processes")
+    args = parser.parse_args()
+    try:
+        levels.check_size(args.height, args.width)
+    except ValueError as error:
+        parser.error(str(error))
+
+    cache = LevelCache(args.directory, height=args.height, width=args.width,
+                       max_disk=args.max_disk, max_memory=0)
+    generated = cache.pregenerate(
+        range(args.first_seed, args.first_seed + args.seeds),
+        range(1, args.levels + 1), args.processes)
+    print("Generated {} levels in {}".format(generated, args.directory))
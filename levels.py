@@ -1,15 +1,57 @@
 """Module implementing level mechanics for CorporateRL game."""
 # import interface
-import random
+import collections
+import copy
+import math
 
 import entities
 import misc
+import npcs
+import pathfinding
+import profiler
 from misc import debug
 
 
 GAME_WIDTH = 80
 GAME_HEIGHT = 22
 SCREEN_HEIGHT = 24
+# Smallest dimensions of a level which is divided into at least two rooms,
+# for the entrance and the exit.
+MIN_HEIGHT = MIN_WIDTH = 6
+
+# Codes of the tiles stored in Level.terrain.
+NOTHING, FLOOR, WALL_H, WALL_V, DOOR, RUBBLE, ENTRANCE, EXIT = range(8)
+WALL_CODES = (WALL_H, WALL_V)
+WALKABLE_CODES = (FLOOR, DOOR, RUBBLE, ENTRANCE, EXIT)
+# Random numbers streams of a level: the rooms, walls and stairs, the monsters
+# placed in the level and the decisions of its NPCs.
+STREAMS = ("layout", "spawns", "ai")
+# Translation table turning a row of the terrain into 1s on walkable tiles.
+WALKABLE_TABLE = bytes(code in WALKABLE_CODES for code in range(256))
+
+# State of a level captured by Level.snapshot. Arrays are kept as immutable
+# bytes, creatures are referenced and their mutable state copied next to them.
+LevelSnapshot = collections.namedtuple("LevelSnapshot", [
+    "terrain", "visibility", "rooms_visible", "player", "creatures",
+    "occupants", "bombs", "npcs", "flow_field",
+    "observation", "exploded", "random_state"])
+
+
+def check_size(height, width):
+    """Check whether levels of the given dimensions may be generated.
+
+    Raises:
+        ValueError: if the level can't be divided into two rooms.
+    """
+    if height < MIN_HEIGHT or width < MIN_WIDTH:
+        raise ValueError("Levels have to be at least {}x{} tiles, not "
+                         "{}x{}".format(MIN_HEIGHT, MIN_WIDTH, height, width))
+
+
+def level_seed(game_seed, level_num):
+    """Get the seed of the level with the given number in the game with the
+    given seed."""
+    return "{}-{}".format(game_seed, level_num)
 
 
 class Wall(misc.GameObject):
@@ -19,6 +61,7 @@ class Wall(misc.GameObject):
         axis (int): integer representing the axis (0 for horizontal, 1 for
             vertical).
     """
+    __slots__ = ("visible", "doors", "axis", "char")
 
     def __init__(self, y, x, h=1, w=1, axis=0):
         super().__init__(y, x, h, w)
@@ -32,6 +75,7 @@ class Wall(misc.GameObject):
 
 class Door(misc.GameObject):
     """Class representing a door. Simple as that."""
+    __slots__ = ("visible", "doors", "char")
 
     def __init__(self, y, x):
         super().__init__(y, x)
@@ -42,6 +86,8 @@ class Door(misc.GameObject):
 
 
 class Room(misc.GameObject):
+    __slots__ = ("visible", "doors", "char")
+
     def __init__(self, y, x, h, w):
         super().__init__(y, x, h, w)
         self.visible = False
@@ -53,6 +99,8 @@ class Room(misc.GameObject):
 
 
 class EmptySpace(misc.GameObject):
+    __slots__ = ("visible", "char")
+
     def __init__(self, y, x):
         super().__init__(y, x, 1, 1)
         self.visible = True
@@ -67,6 +115,7 @@ class Stairs(misc.GameObject):
         axis (int): number representing the way which the stairs leads to: 1
             for downwards and -1 for upwards.
     """
+    __slots__ = ("char", "axis")
 
     def __init__(self, y, x, axis):
         assert axis == -1 or axis == 1
@@ -76,40 +125,110 @@ class Stairs(misc.GameObject):
         self.axis = axis
 
 
+# Shared objects representing the tiles which don't need an individual object.
+# Their position is meaningless, they are used for drawing and walkability.
+TILES = [None for _ in range(EXIT + 1)]
+TILES[WALL_H] = Wall(0, 0, axis=0)
+TILES[WALL_V] = Wall(0, 0, axis=1)
+TILES[DOOR] = Door(0, 0)
+TILES[RUBBLE] = EmptySpace(0, 0)
+
+
 class Level:
     """Class representing a level and containing a multitude of useful
         functions for running the game and controling the game world.
 
     Attributes:
-        grid (list): A 2D array of dimensions (terminal_height, terminal_width)
-            containing references for architecture elements (i.e. rooms, doors,
-            walls) at any given point.
+        terrain (list): rows of dimensions (terminal_height, terminal_width),
+            each a bytearray containing the code of the architecture element
+            (e.g. FLOOR, WALL_H, DOOR) at any given point. See tile_at for
+            getting the corresponding object.
         rooms (list): array containing rooms in the level
-        visibility (list): A 2D array of dimensions (terminal_height,
-            terminal_width) containing boolean values representing whether this
-            point on the map is visible or not.
+        visibility (list): rows of dimensions (terminal_height,
+            terminal_width), each a bytearray containing 1 where the point on
+            the map is visible and 0 where it's not.
         creatures (list): array containing references to all living creatures
             (player, monsters, bombs) on the map.
+        occupants (dict): spatial hash mapping (y, x) positions to the list of
+            creatures standing there, kept in sync with creatures.
+        room_ids (list): A 2D array of the same dimensions as terrain
+            containing the index of the room in rooms covering any given
+            point, -1 outside of rooms.
+        bombs (list): all bombs in the level, subset of creatures.
+        npcs (NPCStore): NPCs in the level, subset of creatures.
+        encoder (ObservationEncoder): encoder kept up to date with the level,
+            None if there's none attached.
+        flow_field (FlowField): distances to the player shared by the NPCs.
         exploded (list): tiles to be drawn as exploded in the next turn.
+        height, width (ints): dimensions of the level.
+        max_divisions (int): maximum depth of the recursive division, larger
+            levels are divided deeper to keep the rooms' size similar.
+        random (RandomStreams): random numbers streams of the level (see
+            STREAMS), independent of the global random module.
     """
 
 
-    def __init__(self, level_num, player, entrance=None):
+    def __init__(self, level_num, player, entrance=None, seed=None,
+                 height=GAME_HEIGHT, width=GAME_WIDTH, generate=True):
+        """Generates the level.
+
+        The player isn't touched here, so the level may be generated in
+        advance (e.g. in another thread) - place_player puts them in the
+        level when they arrive.
+
+        Args:
+            level_num (int): number of the level.
+            player (Player): the player character.
+            entrance (tuple of ints): unused.
+            seed (int or str): seed of the level's random numbers streams,
+                the same seed generates the same level.
+            height (int): height of the level, may exceed the screen's.
+            width (int): width of the level, may exceed the screen's.
+            generate (boolean): whether to generate the level, an empty level
+                is left for set_layout otherwise (e.g. when loading a saved
+                game) and its flow_field has to be created once the terrain
+                is set.
+        Raises:
+            ValueError: if the level is too small to be generated, see
+                check_size.
+        """
+        if generate:
+            check_size(height, width)
+        self.random = misc.RandomStreams(seed, STREAMS)
+        self.height = height
+        self.width = width
+        area_ratio = (height * width) / (GAME_HEIGHT * GAME_WIDTH)
+        self.max_divisions = 4 + max(0, int(math.log2(area_ratio)))
+
         self.rooms = []
         self._entrance = entrance if entrance else (15, 15)
-        self.grid = [[None for _ in range(GAME_WIDTH)]
-                     for _ in range(GAME_HEIGHT)]
-        self.visibility = [[False for _ in range(GAME_WIDTH)]
-                           for _ in range(GAME_HEIGHT)]
+        self.terrain = [bytearray(width) for _ in range(height)]
+        self.visibility = [bytearray(width) for _ in range(height)]
+        self.room_ids = [[-1 for _ in range(width)]
+                         for _ in range(height)]
 
         self.level_num = level_num
         self.player = player
-        self.walls = []
-        self.doors = []
         self.exploded = []
         self.creatures = [self.player]
-        self.generate_level()
-
+        self.occupants = {}
+        self.bombs = []
+        self.npcs = npcs.NPCStore()
+        self.encoder = None
+        self.flow_field = None
+        if generate:
+            self.generate_level()
+            self.flow_field = pathfinding.FlowField(self)
+
+    def place_player(self, y=None, x=None):
+        """Put the player on the entrance of the level, or at the given
+        position."""
+        if y is None:
+            y, x = self.entrance.y, self.entrance.x
+        self.player.move(y, x)
+        self._occupy(self.player)
+
+    @profiler.timed("level_tick")
     def tick(self):
         """Update situation in the level - set visible rooms etc."""
         top_edge, left_edge, bottom_edge, right_edge = (
@@ -117,12 +236,11 @@ class Level:
                                    additional_radius=1))
         for y in range(top_edge, bottom_edge):
             for x in range(left_edge, right_edge):
-                tile = self.grid[y][x]
-                if isinstance(tile, Room):
-                    self.set_visibility(tile, True, 1)
-
-        if isinstance(tile, Room):
-            self.set_visibility(tile, True, 1)
+                if self.terrain[y][x] != FLOOR:
+                    continue
+                room = self.rooms[self.room_ids[y][x]]
+                if not room.visible:
+                    self.set_visibility(room, True, 1)
 
     def in_bounds(self, y, x):
         """Check if the fiven position is in the bound of the level.
@@ -134,7 +252,7 @@ class Level:
         Returns:
             True if position is in the level, False otherwise.
         """
-        return 0 <= y < GAME_HEIGHT and 0 <= x < GAME_WIDTH
+        return 0 <= y < self.height and 0 <= x < self.width
 
     def recursive_divide(self, y, x, h, w, step=0):
         """Recursively and randomly divide given space.
@@ -159,71 +277,72 @@ class Level:
                 completed, useful for stopping condition.
         """
         room_too_small = w < 6 or h < 6
-        random_chance = (step > 3 and random.random() < step * 0.04)
-        if room_too_small or step > 4 or random_chance:
+        random_chance = (step > self.max_divisions - 1
+                         and self.random.layout.random() < step * 0.04)
+        if room_too_small or step > self.max_divisions or random_chance:
             return [[y, x, h, w]]
 
-        unnormalized_probs = [h * h * h, w * w * w]
-        normalization = sum(unnormalized_probs)
-        probs = [prob / normalization for prob in unnormalized_probs]
-        axis = misc.random_choice([0, 1], probs=probs)
-        doorless = True
+        axis_sampler = misc.WeightedSampler([0, 1], [h * h * h, w * w * w])
+        axis = axis_sampler.sample(self.random.layout)
 
         if axis == 0:
-            wall_y = random.randint(2, h - 3)
+            wall_y = self.random.layout.randint(2, h - 3)
             self.set_wall(y + wall_y, x, 1, w, axis)
-            door_x = random.randint(x, x + w)
             divisions = (self.recursive_divide(y, x, wall_y, w, step + 1),
                          self.recursive_divide(y + wall_y + 1, x,
                                                h - (wall_y + 1), w, step + 1))
 
-            while doorless:
-                door_x = random.randint(x, x + w - 2)
-                first_cond = any((y + wall_y + 1, door_x) in wall
-                                 for wall in self.walls)
-                second_cond = any((y + wall_y - 1, door_x) in wall
-                                  for wall in self.walls)
-                doorless = first_cond or second_cond
-
-            self.doors += [Door(y + wall_y, door_x)]
+            self.place_door(y + wall_y, x, 1, w - 1, axis)
             return divisions[0] + divisions[1]
 
         elif axis == 1:
-            wall_x = random.randint(2, w - 3)
+            wall_x = self.random.layout.randint(2, w - 3)
             self.set_wall(y, x + wall_x, h, 1, axis)
-            door_y = random.randint(y, y + h)
             divisions = (self.recursive_divide(y, x, h, wall_x, step + 1),
                          self.recursive_divide(y, x + wall_x + 1,
                                                h, w - (wall_x + 1), step + 1))
 
-            while doorless:
-                door_y = random.randint(y, y + h - 2)
-                first_cond = any((door_y, x + wall_x + 1) in wall
-                                 for wall in self.walls)
-                second_cond = any((door_y, x + wall_x - 1) in wall
-                                  for wall in self.walls)
-                doorless = first_cond or second_cond
-
-            self.doors += [Door(door_y, x + wall_x)]
+            self.place_door(y, x + wall_x, h - 1, 1, axis)
             return divisions[0] + divisions[1]
         else:
             raise ValueError("Axis isn't 0 or 1?!")
 
+    def place_door(self, y, x, h, w, axis):
+        """Put a door in a random place on the given part of the wall.
+
+        The door is placed only where it doesn't lead straight into another
+        wall (or door) on either side. All such places are found with one
+        pass over the wall, so the placement always finishes. If there are
+        none, any place on the wall is chosen.
+
+        Args:
+            y, x, h, w (ints): part of the wall the door may be placed in.
+            axis (int): whether the wall is horizontal (0) or vertical (1).
+        """
+        delta_y, delta_x = (1, 0) if axis == 0 else (0, 1)
+        cells = [(y_, x_) for y_ in range(y, y + h)
+                 for x_ in range(x, x + w)]
+        candidates = [(y_, x_) for y_, x_ in cells
+                      if not self.is_wall(y_ + delta_y, x_ + delta_x)
+                      and not self.is_wall(y_ - delta_y, x_ - delta_x)]
+
+        door_y, door_x = self.random.layout.choice(candidates or cells)
+        self.set_tile(door_y, door_x, DOOR)
+
     @property
     def architecture(self):
-        """Get all "unmovable" objects in the level - rooms, walls, doors and
-        stairs in the level.
+        """Get all "unmovable" objects in the level which have their own
+        objects - rooms and stairs. Walls and doors only exist in terrain.
 
         Returns:
             Array with references to architecture objects. Order is important.
         """
-        return (self.rooms + self.walls + self.doors
-                + [self.entrance] + [self.exit])
+        return self.rooms + [self.entrance] + [self.exit]
 
     def generate_random_monster(self, y, x):
         """Get random monster to put in the level. At the moment only one
         monster available."""
-        return entities.CorporateZombie(y, x)
+        return entities.CorporateZombie(y, x, rng=self.random.spawns)
 
     def generate_stairs(self):
         """Randomly choose a place to place stairs (upwards and downwards).
@@ -231,57 +350,140 @@ class Level:
         Returns:
             Two stairs objects representing entrance and exit.
         """
-        entrance_room, exit_room = misc.random_choice(self.rooms, size=2)
+        layout = self.random.layout
+        room_sampler = misc.WeightedSampler(self.rooms)
+        entrance_room, exit_room = room_sampler.sample_many(2, layout)
         while entrance_room is exit_room:
-            exit_room = misc.random_choice(self.rooms)
+            exit_room = room_sampler.sample(layout)
 
-        entrance_y = random.randrange(entrance_room.y,
+        entrance_y = layout.randrange(entrance_room.y,
                                       entrance_room.y + entrance_room.h)
-        entrance_x = random.randrange(entrance_room.x,
+        entrance_x = layout.randrange(entrance_room.x,
                                       entrance_room.x + entrance_room.w)
 
         entrance = Stairs(entrance_y, entrance_x, -1)
 
-        exit_y = random.randrange(exit_room.y, exit_room.y + exit_room.h)
-        exit_x = random.randrange(exit_room.x, exit_room.x + exit_room.w)
+        exit_y = layout.randrange(exit_room.y, exit_room.y + exit_room.h)
+        exit_x = layout.randrange(exit_room.x, exit_room.x + exit_room.w)
 
         exit_ = Stairs(exit_y, exit_x, 1)
         return entrance, exit_
 
+    @profiler.timed("generate_level")
     def generate_level(self):
         """Generate a new level when the player descends.
 
         The function divides the level recursively into rooms, places an
         entrance and exit and places some monsters.
         """
-        room_coords = self.recursive_divide(0, 0, GAME_HEIGHT, GAME_WIDTH)
+        room_coords = self.recursive_divide(0, 0, self.height, self.width)
         debug(room_coords)
 
         self.rooms = [Room(y, x, h, w) for y, x, h, w in room_coords]
-        self.entrance, self.exit = self.generate_stairs()
-
-        for object_ in self.architecture:
-            self.add_to_grid(object_)
+        entrance, exit_ = self.generate_stairs()
+        self.set_layout(self.rooms, entrance, exit_)
 
+        # Rooms are about the same size in levels of any size, so is the
+        # number of monsters in them.
+        spawns = self.random.spawns
         for room in self.rooms:
             threshold = 0.2 + 4 * (room.w * room.h) / (GAME_WIDTH * GAME_HEIGHT)
-            while random.random() < threshold:
-                tile_y = random.randrange(room.y, room.y + room.h)
-                tile_x = random.randrange(room.x, room.x + room.w)
+            while spawns.random() < threshold:
+                tile_y = spawns.randrange(room.y, room.y + room.h)
+                tile_x = spawns.randrange(room.x, room.x + room.w)
                 monster = self.generate_random_monster(tile_y, tile_x)
-                self.creatures += [monster]
+                self.add_creature(monster)
                 threshold = max(0.1, threshold - 0.1)
 
 
-    def add_to_grid(self, object_):
-        """Add the object to the architectural grid of the level.
+    def set_layout(self, rooms, entrance, exit_):
+        """Set the rooms and stairs of the level and put them in the terrain.
+        Walls and doors between the rooms have to be set separately.
 
         Args:
-            object_ (GameObject): object to add to the grid.
+            rooms (list): Room objects.
+            entrance (Stairs): upwards stairs.
+            exit_ (Stairs): downwards stairs.
         """
-        for y in range(object_.y, object_.y + object_.h):
-            for x in range(object_.x, object_.x + object_.w):
-                self.grid[y][x] = object_
+        self.rooms = rooms
+        self.entrance, self.exit = entrance, exit_
+
+        for room_id, room in enumerate(self.rooms):
+            self.add_to_grid(room, room_id)
+        self.add_to_grid(self.entrance)
+        self.add_to_grid(self.exit)
+
+    def add_to_grid(self, object_, room_id=None):
+        """Add the object (room or stairs) to the terrain of the level.
+
+        Args:
+            object_ (GameObject): object to add to the terrain.
+            room_id (int): index of the room in rooms, looked up if it's not
+                given.
+        """
+        if isinstance(object_, Stairs):
+            code = ENTRANCE if object_.axis == -1 else EXIT
+        else:
+            code = FLOOR
+
+        rows = range(object_.y, object_.y + object_.h)
+        left, right = object_.x, object_.x + object_.w
+        if self.encoder is None and self.flow_field is None:
+            # Nothing to notify, so whole rows are written at once.
+            for y in rows:
+                self.terrain[y][left:right] = bytes((code,)) * object_.w
+        else:
+            for y in rows:
+                for x in range(left, right):
+                    self.set_tile(y, x, code)
+
+        if isinstance(object_, Room):
+            if room_id is None:
+                room_id = self.rooms.index(object_)
+            for y in rows:
+                self.room_ids[y][left:right] = [room_id] * object_.w
+
+    def set_tile(self, y, x, code):
+        """Set the terrain at the given position.
+
+        Args:
+            y, x (ints): position of the tile.
+            code (int): code of the tile, e.g. WALL_H.
+        """
+        self.terrain[y][x] = code
+        if self.encoder is not None:
+            self.encoder.set_tile(y, x, code)
+        if self.flow_field is not None:
+            self.flow_field.tile_changed(y, x)
+
+    def tile_at(self, y, x):
+        """Get the architecture object at the given position.
+
+        Args:
+            y, x (ints): position of the tile.
+        Returns:
+            The room or stairs object at the position, the shared tile object
+            for walls, doors and rubble, or None if there's nothing there.
+        """
+        code = self.terrain[y][x]
+        if code == FLOOR:
+            return self.rooms[self.room_ids[y][x]]
+        if code == ENTRANCE:
+            return self.entrance
+        if code == EXIT:
+            return self.exit
+        return TILES[code]
+
+    def is_walkable(self, y, x):
+        """Check whether creatures may walk on the terrain at the given
+        position (regardless of other creatures)."""
+        return self.terrain[y][x] in WALKABLE_CODES
+
+    def is_wall(self, y, x):
+        """Check whether there's a wall (or a door in it) at the given
+        position."""
+        code = self.terrain[y][x]
+        return code in WALL_CODES or code == DOOR
 
     def set_visibility(self, object_, visible, additional_radius=0):
         """Sets the visibility of given object according to the passed values.
@@ -298,39 +500,207 @@ class Level:
                                    object_.h, object_.w,
                                    additional_radius))
 
+        row = (b"\x01" if visible else b"\x00") * (right_edge - left_edge)
         for y in range(top_edge, bottom_edge):
-            for x in range(left_edge, right_edge):
-                self.visibility[y][x] = visible
+            self.visibility[y][left_edge:right_edge] = row
+        object_.visible = visible
+
+        if self.encoder is not None:
+            self.encoder.set_visible(top_edge, left_edge, bottom_edge,
+                                     right_edge, visible)
+
+    def snapshot(self):
+        """Capture the state of the level, so that it may be restored later.
+
+        Only the arrays and the creatures' mutable state are copied - the
+        generated layout is shared - so taking a snapshot is much cheaper than
+        copying the level. Snapshots are never modified and may be restored
+        any number of times.
+
+        Returns:
+            LevelSnapshot of the level.
+        """
+        player = self.player
+        return LevelSnapshot(
+            terrain=b"".join(self.terrain),
+            visibility=b"".join(self.visibility),
+            rooms_visible=bytes(room.visible for room in self.rooms),
+            player=(player.y, player.x, player.hp, player.max_hp,
+                    player.bombs_n, player.max_damage),
+            creatures=tuple(self.creatures),
+            occupants={pos: tuple(occupants)
+                       for pos, occupants in self.occupants.items()},
+            bombs=tuple((bomb, bomb.y, bomb.x, bomb.hp, bomb.time_till_blow)
+                        for bomb in self.bombs),
+            npcs=self.npcs.snapshot(),
+            flow_field=self.flow_field.snapshot(),
+            observation=(None if self.encoder is None
+                         else bytes(self.encoder.buffer)),
+            exploded=tuple(self.exploded),
+            random_state=self.random.getstate())
+
+    def restore(self, snapshot):
+        """Bring the level back to the state captured in the snapshot.
+
+        Creatures are put back as they were, including the ones which have
+        been removed since. The occupancy index, the NPC store, the flow field
+        and the attached encoder are restored as well.
+
+        Args:
+            snapshot (LevelSnapshot): snapshot of this level.
+        """
+        terrain = memoryview(snapshot.terrain)
+        visibility = memoryview(snapshot.visibility)
+        for y in range(self.height):
+            start = y * self.width
+            self.terrain[y][:] = terrain[start:start + self.width]
+            self.visibility[y][:] = visibility[start:start + self.width]
+        for room, visible in zip(self.rooms, snapshot.rooms_visible):
+            room.visible = bool(visible)
+
+        player = self.player
+        (player.y, player.x, player.hp, player.max_hp, player.bombs_n,
+         player.max_damage) = snapshot.player
+
+        self.creatures[:] = snapshot.creatures
+        self.occupants = {pos: list(occupants)
+                          for pos, occupants in snapshot.occupants.items()}
+        self.bombs[:] = [bomb for bomb, _, _, _, _ in snapshot.bombs]
+        for bomb, y, x, hp, time_till_blow in snapshot.bombs:
+            bomb.y, bomb.x, bomb.hp = y, x, hp
+            bomb.time_till_blow = time_till_blow
+        self.npcs.restore(snapshot.npcs)
+        self.flow_field.restore(snapshot.flow_field)
+
+        if self.encoder is not None:
+            if snapshot.observation is None:
+                self.encoder.encode_level(self)
+            else:
+                self.encoder.buffer[:] = snapshot.observation
+
+        self.exploded = list(snapshot.exploded)
+        self.random.setstate(snapshot.random_state)
+
+    def clone(self, player=None):
+        """Get an independent copy of the level, e.g. for trying out moves.
+
+        The layout which never changes after generation is shared, creatures
+        get copied.
+
+        Args:
+            player (Player): the player character of the copy, a copy of the
+                level's player by default. Its state is overwritten with the
+                state of the level's player.
+        Returns:
+            The new Level.
+        """
+        snapshot = self.snapshot()
+        if player is None:
+            player = copy.copy(self.player)
+
+        copies = {id(creature): copy.copy(creature)
+                  for creature in snapshot.creatures}
+        copies[id(self.player)] = player
+
+        def own(creatures):
+            return tuple(copies[id(creature)] for creature in creatures)
+
+        columns, npc_states, next_id = snapshot.npcs
+        snapshot = snapshot._replace(
+            creatures=own(snapshot.creatures),
+            occupants={pos: own(occupants)
+                       for pos, occupants in snapshot.occupants.items()},
+            bombs=tuple((copies[id(bomb)],) + tuple(state)
+                        for bomb, *state in snapshot.bombs),
+            npcs=(columns,
+                  tuple((copies[id(npc)],) + tuple(state)
+                        for npc, *state in npc_states),
+                  next_id))
+
+        other = copy.copy(self)
+        other.player = player
+        other.rooms = [copy.copy(room) for room in self.rooms]
+        other.terrain = [bytearray(self.width) for _ in range(self.height)]
+        other.visibility = [bytearray(self.width)
+                            for _ in range(self.height)]
+        other.creatures = []
+        other.bombs = []
+        other.npcs = npcs.NPCStore()
+        other.random = misc.RandomStreams(None, STREAMS)
+        other.encoder = None
+        if self.encoder is not None:
+            other.encoder = copy.copy(self.encoder)
+            other.encoder.buffer = bytearray(len(self.encoder.buffer))
+        other.flow_field = pathfinding.FlowField(other)
+        other.restore(snapshot)
+        return other
+
+    def attach_encoder(self, encoder):
+        """Attach the observation encoder, which will be kept up to date with
+        the level from now on.
+
+        Args:
+            encoder (ObservationEncoder): encoder of the level's size.
+        """
+        self.encoder = encoder
+        encoder.encode_level(self)
+
+    def observe(self):
+        """Get the observation from the attached encoder.
 
+        Only bombs' fuses, which change every turn, are encoded here - the
+        rest of the observation is updated as the level changes.
+
+        Returns:
+            memoryview of shape (channels, height, width), see
+            ObservationEncoder.
+        """
+        for bomb in self.bombs:
+            self.encoder.set_occupants(bomb.y, bomb.x,
+                                       self.occupants[(bomb.y, bomb.x)])
+        return self.encoder.view()
+
+    @profiler.timed("level_draw")
     def draw(self, interface):
-        """Draw the whole level using the passed interface.
+        """Draw the part of the level seen by the interface's camera.
+
+        Only the tiles inside the viewport are visited, so the cost doesn't
+        depend on the size of the level.
 
         Args:
             interface (Interface): object representing the game interface.
         """
         interface.clear_screen()
+        top_edge, left_edge, bottom_edge, right_edge = interface.focus(
+            self.player.y, self.player.x, self.height, self.width)
 
-        # Draw all architectural tiles.
-        for y, row in enumerate(self.grid):
-            for x, cell in enumerate(row):
-                if not self.visibility[y][x] or not cell:
+        tiles_drawn = 0
+        for y in range(top_edge, bottom_edge):
+            row = self.terrain[y]
+            visibility = self.visibility[y]
+            for x in range(left_edge, right_edge):
+                if not visibility[x]:
                     continue
-                interface.draw_tile(y, x, cell)
 
-        # Draw all visible entities.
-        for creature in self.creatures:
-            if self.visibility[creature.y][creature.x]:
-                interface.draw_object(creature)
+                # Draw the architectural tile and the entity on top of it.
+                if row[x] != NOTHING:
+                    interface.draw_tile(y, x, self.tile_at(y, x))
+                    tiles_drawn += 1
+                occupants = self.occupants.get((y, x))
+                if occupants:
+                    interface.draw_tile(y, x, occupants[-1])
+                    tiles_drawn += 1
 
+        profiler.count("tiles drawn", tiles_drawn)
         interface.draw_explosion(self.exploded)
         self.exploded = []
 
     def get_bounded_range(self, y, x, h, w, additional_radius=0):
         """Get range of the arguments taking in account game screen size."""
         top_edge = max(0, y - additional_radius)
-        bottom_edge = min(GAME_HEIGHT, y + h + additional_radius)
+        bottom_edge = min(self.height, y + h + additional_radius)
         left_edge = max(0, x - additional_radius)
-        right_edge = min(GAME_WIDTH, x + w + additional_radius)
+        right_edge = min(self.width, x + w + additional_radius)
 
         return top_edge, left_edge, bottom_edge, right_edge
 
@@ -346,59 +716,148 @@ class Level:
         if not self.in_bounds(y, x):
             return None
 
-        for creature in self.creatures:
-            if pos in creature:
-                return creature
+        occupants = self.occupants.get((y, x))
+        if occupants:
+            return occupants[0]
+
+        return self.tile_at(y, x)
+
+    def _occupy(self, creature):
+        """Register the creature in the occupancy index at its position."""
+        pos = (creature.y, creature.x)
+        occupants = self.occupants.get(pos)
+        if occupants is None:
+            self.occupants[pos] = [creature]
+        else:
+            occupants.append(creature)
+
+        if self.encoder is not None:
+            self.encoder.set_occupants(pos[0], pos[1], self.occupants[pos])
+
+    def _vacate(self, creature):
+        """Remove the creature from the occupancy index at its position."""
+        pos = (creature.y, creature.x)
+        occupants = self.occupants[pos]
+        occupants.remove(creature)
+        if not occupants:
+            del self.occupants[pos]
+
+        if self.encoder is not None:
+            self.encoder.set_occupants(pos[0], pos[1], occupants)
 
-        return self.grid[y][x]
+    def add_creature(self, creature):
+        """Add the creature to the level.
+
+        Args:
+            creature (Entity): creature to add, placed at its own position.
+        """
+        self.creatures += [creature]
+        if isinstance(creature, entities.Bomb):
+            self.bombs += [creature]
+        elif type(creature) in npcs.KINDS:
+            self.npcs.add(creature)
+        self._occupy(creature)
+
+    def remove_creature(self, creature):
+        """Remove the creature from the level.
+
+        Args:
+            creature (Entity): creature to remove.
+        """
+        self.creatures.remove(creature)
+        self._vacate(creature)
+        if isinstance(creature, entities.Bomb):
+            self.bombs.remove(creature)
+        elif type(creature) in npcs.KINDS:
+            self.npcs.remove(creature)
+
+    def remove_creatures(self, creatures):
+        """Remove many creatures from the level at once, going through the
+        lists of creatures and bombs only once.
+
+        Args:
+            creatures (list): creatures to remove, each of them once.
+        """
+        removed = set(creatures)
+        for creature in creatures:
+            self._vacate(creature)
+        self.npcs.remove_many([creature for creature in creatures
+                               if type(creature) in npcs.KINDS])
+
+        self.creatures[:] = [creature for creature in self.creatures
+                             if creature not in removed]
+        self.bombs[:] = [bomb for bomb in self.bombs if bomb not in removed]
+
+    def move_creature(self, creature, y, x):
+        """Move the creature to the given position, keeping the occupancy
+        index up to date.
+
+        Args:
+            creature (Entity): creature to move.
+            y (int): target vertical position.
+            x (int): target horizontal position.
+        """
+        self._vacate(creature)
+        creature.move(y, x)
+        self._occupy(creature)
 
     def set_wall(self, y, x, h, w, axis):
-        """Set a set of one-tile walls on the given area.
+        """Set walls on the given area of the terrain.
 
         Args;
             y, x, h, w (ints): numbers representing the coordinates where we
                 want to set the wall.
             axis (int): wheter the wall is vertical or horizontal.
         """
+        code = WALL_CODES[axis]
         for y_ in range(y, y + h):
             for x_ in range(x, x + w):
-                self.walls += [Wall(y_, x_, axis=axis)]
+                self.set_tile(y_, x_, code)
 
     def put_bomb(self, y, x):
         """Puts a bomb at the given position."""
-        self.creatures += [entities.Bomb(y, x)]
+        self.add_creature(entities.Bomb(y, x))
 
+    @profiler.timed("explosion")
     def explosion(self, bomb):
         """Calculates results of the explosion of the given bomb.
 
+        Bombs caught in the explosion explode as well. They're handled one
+        after another from a worklist, each of them once, and only the tiles
+        of their blast stencils are visited.
+
         Args:
             bomb (Bomb)- a bomb which explodes.
+        Returns:
+            List of all bombs which exploded, already removed from the level.
         """
         assert isinstance(bomb, entities.Bomb)
 
-        self.creatures.remove(bomb)
-        for creature in self.creatures:
-            if not bomb.reaches(creature):
-                continue
-
-            # If the second bomb is in range of the first bomb, we'd like
-            # to make it explode as well.
-            if isinstance(creature, entities.Bomb):
-                self.explosion(creature)
-            else:
-                creature.hp -= 10
-
-        top_edge, left_edge, bottom_edge, right_edge = (
-            self.get_bounded_range(bomb.y, bomb.x, 1, 1, bomb.range))
+        chain = [bomb]
+        pending = [bomb]
+        set_off = {bomb}
+        while pending:
+            bomb = pending.pop()
+            for delta_y, delta_x in bomb.stencil:
+                y = bomb.y + delta_y
+                x = bomb.x + delta_x
+                if not self.in_bounds(y, x):
+                    continue
 
-        for y in range(top_edge, bottom_edge):
-            for x in range(left_edge, right_edge):
-                if bomb.reaches((y, x)):
-                    self.exploded += [(y, x)]
-                    exploded_obj = self.grid[y][x]
-                    if isinstance(exploded_obj, Wall):
-                        self.walls.remove(exploded_obj)
-                        self.grid[y][x] = EmptySpace(y, x)
-                    elif isinstance(exploded_obj, Door):
-                        self.doors.remove(exploded_obj)
-                        self.grid[y][x] = EmptySpace(y, x)
+                self.exploded.append((y, x))
+                if self.is_wall(y, x):
+                    self.set_tile(y, x, RUBBLE)
+
+                for creature in self.occupants.get((y, x), ()):
+                    # If the second bomb is in range of the first bomb, we'd
+                    # like to make it explode as well.
+                    if isinstance(creature, entities.Bomb):
+                        if creature not in set_off:
+                            set_off.add(creature)
+                            chain.append(creature)
+                            pending.append(creature)
+                    else:
+                        creature.hp -= 10
+
+        self.remove_creatures(chain)
+        return chain
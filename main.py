@@ -1,10 +1,21 @@
 #!/usr/bin/env python
 """This module implements the CorporateRL game. Have fun!"""
+import argparse
+import collections
+import concurrent.futures
 import curses
+import logging
+import random
 
 import entities
 import interface
+import level_cache
 import levels
+import misc
+import profiler
+import replay
+import running
+import saves
 from misc import debug
 
 
@@ -22,21 +33,100 @@ DIRECTIONS = {"KEY_DOWN": (1, 0),
               "k": (-1, 0),
               "y": (-1, -1)}
 
+# Keys taking a turn, their indices are the codes of the actions recorded in
+# Game.actions (see replay). Arrow keys are recorded as the letters moving in
+# the same direction.
+ACTIONS = ("h", "v", "j", "n", "l", "u", "k", "y", " ", ">")
+ACTION_CODES = {key: code for code, key in enumerate(ACTIONS)}
+ACTION_CODES.update({"KEY_DOWN": ACTION_CODES["j"],
+                     "KEY_UP": ACTION_CODES["k"],
+                     "KEY_RIGHT": ACTION_CODES["l"],
+                     "KEY_LEFT": ACTION_CODES["h"]})
+# Keys taking the step in the given direction.
+STEP_KEYS = {DIRECTIONS[key]: key for key in ACTIONS if key in DIRECTIONS}
+
+# Keys running in a direction (shift + direction, see running) and
+# travelling to the exit. Runs are recorded as the steps they take.
+RUN_KEYS = {key.upper(): direction for key, direction in DIRECTIONS.items()
+            if len(key) == 1}
+RUN_KEYS.update({"KEY_SF": (1, 0),
+                 "KEY_SR": (-1, 0),
+                 "KEY_SRIGHT": (0, 1),
+                 "KEY_SLEFT": (0, -1)})
+TRAVEL_KEY = "T"
+
+# Random numbers streams of a game, next to the streams of its levels (see
+# levels.STREAMS): the damage dealt in fights.
+STREAMS = ("combat",)
+
+# State of a game captured by Game.snapshot.
+GameSnapshot = collections.namedtuple("GameSnapshot", [
+    "level_num", "level", "level_state", "random_state", "actions"])
+
 
 class Game:
     """Class representing the game object, the main part of the program"""
 
-    def __init__(self):
-        """Prepares for the first launch"""
+    def __init__(self, seed=None, prefetch=False,
+                 height=levels.GAME_HEIGHT, width=levels.GAME_WIDTH,
+                 level_cache=None):
+        """Prepares for the first launch
+
+        Args:
+            seed (int): seed from which the seeds of all levels and random
+                numbers streams are derived, random by default. Games with
+                the same seed and the same actions play out the same. It has
+                to be in saves.SEED_RANGE, so that the game may be saved.
+            prefetch (boolean): whether to generate the next level in
+                a background thread while the current one is played.
+            height, width (ints): dimensions of the levels, the screen
+                scrolls if they don't fit in it.
+            level_cache (LevelCache): cache to load the levels from instead
+                of generating them, its dimensions are used instead of the
+                given ones.
+        Raises:
+            ValueError: if the seed is out of saves.SEED_RANGE.
+        """
         self.interface = None
         self.level_num = 0
         self.current_level = None
         self.player = entities.Player(0, 0)
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        if self.seed not in saves.SEED_RANGE:
+            raise ValueError("The seed has to be in [{}, {}]".format(
+                saves.SEED_RANGE[0], saves.SEED_RANGE[-1]))
+        self.random = misc.RandomStreams(self.seed, STREAMS)
+        self.level_cache = level_cache
+        if level_cache is not None:
+            height, width = level_cache.height, level_cache.width
+        self.height = height
+        self.width = width
+        self.save_path = saves.SAVE_FILE
+        # Codes of all actions taken in the game, see ACTIONS.
+        self.actions = bytearray()
+        self.run = None
+
+        self.executor = None
+        self.next_level = None
+        if prefetch:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1)
 
     def prepare_game(self, stdscr):
-        """Sets up the interface and the first level."""
-        self.interface = interface.Interface(stdscr)
-        self.descend()
+        """Sets up the curses interface and the first level."""
+        self.start(interface.Interface(stdscr))
+
+    def start(self, interface_):
+        """Sets up the given interface and the first level, unless the game
+        has been loaded from a save.
+
+        Args:
+            interface_ (Interface): interface to run the game with, e.g.
+                NullInterface for headless runs.
+        """
+        self.interface = interface_
+        if self.current_level is None:
+            self.descend()
 
     def main_loop(self, stdscr):
         """The main loop of the game - taktakes player input and calculates the
@@ -46,6 +136,9 @@ class Game:
         while self.player.hp > 0:
             self.world_tick()
             self.check_world_status()
+            # Steps of runs are taken without drawing or waiting for input.
+            if self.run is not None and self.continue_run():
+                continue
             self.draw()
             self.handle_player_action()
 
@@ -54,11 +147,92 @@ class Game:
         statistics"""
 
         self.level_num += 1
-        self.current_level = levels.Level(self.level_num, self.player)
-        entrance = self.current_level.entrance
-        self.player.move(entrance.y, entrance.x)
+        if self.next_level is not None:
+            self.current_level = self.next_level.result()
+        else:
+            self.current_level = self.create_level(self.level_num)
+        self.current_level.place_player()
         self.player.reset()
 
+        if self.executor is not None:
+            self.next_level = self.executor.submit(self.create_level,
+                                                   self.level_num + 1)
+
+    def create_level(self, level_num):
+        """Generates the level with the given number, or loads it from the
+        level cache. The level depends only on the game's seed and its
+        number, so it may be generated in advance.
+
+        Args:
+            level_num (int): number of the level.
+        Returns:
+            The new Level.
+        """
+        if self.level_cache is not None:
+            return self.level_cache.get(self.seed, level_num, self.player)
+        return levels.Level(level_num, self.player,
+                            seed=levels.level_seed(self.seed, level_num),
+                            height=self.height, width=self.width)
+
+    def snapshot(self, actions=True):
+        """Capture the state of the game, so that it may be restored later -
+        e.g. to look a few turns ahead and come back.
+
+        Args:
+            actions (boolean): whether to capture the actions taken so far.
+                Their copy grows with the game, so callers which keep the
+                actions anyway (e.g. replays) may leave them out.
+        Returns:
+            GameSnapshot with the current level, its state (see
+            Level.snapshot), the state of the game's random numbers streams
+            and the actions taken so far (None if left out).
+        """
+        return GameSnapshot(self.level_num, self.current_level,
+                            self.current_level.snapshot(),
+                            self.random.getstate(),
+                            bytes(self.actions) if actions else None)
+
+    def restore(self, snapshot):
+        """Bring the game back to the captured state.
+
+        Args:
+            snapshot (GameSnapshot): snapshot of this game. If its actions
+                were left out, the actions taken by the game are left as
+                they are.
+        """
+        if snapshot.level is not self.current_level:
+            # The prefetched level follows the level the game has left.
+            self.next_level = None
+            if self.executor is not None:
+                self.next_level = self.executor.submit(
+                    self.create_level, snapshot.level_num + 1)
+
+        self.level_num = snapshot.level_num
+        self.current_level = snapshot.level
+        self.current_level.restore(snapshot.level_state)
+        self.random.setstate(snapshot.random_state)
+        if snapshot.actions is not None:
+            self.actions[:] = snapshot.actions
+        self.run = None
+
+    def clone(self):
+        """Get an independent copy of the game, e.g. for tree search.
+
+        The copy runs headless (with NullInterface) and doesn't prefetch
+        levels. It has its own random numbers streams, in the same state.
+
+        Returns:
+            The new Game.
+        """
+        other = Game(self.seed, height=self.height, width=self.width)
+        other.interface = interface.NullInterface()
+        other.level_num = self.level_num
+        other.current_level = self.current_level.clone()
+        other.player = other.current_level.player
+        other.random.setstate(self.random.getstate())
+        other.actions[:] = self.actions
+        return other
+
     def farewell(self):
         """Prints a goodbye message after game over."""
         print("Sorry, you died. Better luck next time!")
@@ -75,12 +249,20 @@ class Game:
             self.player.hp, self.player.max_hp,
             self.player.bombs_n, level_num)
 
+    @profiler.timed("draw")
     def draw(self):
-        """Draws the whole game screen."""
+        """Draws the whole game screen, with the profiler's summary over the
+        level if its overlay is on."""
         self.current_level.draw(self.interface)
+        if profiler.PROFILER.overlay:
+            for y, line in enumerate(profiler.PROFILER.summary(), 1):
+                if y >= self.interface.height - 1:
+                    break
+                self.interface.display_message(y, line)
         self.interface.set_player_status(self.status)
         self.interface.refresh_and_center(self.player.y, self.player.x)
 
+    @profiler.timed("handle_player_action")
     def handle_player_action(self):
         """Gets user input from the interface module and tries to interpret it.
         In case of failure it waits for another input."""
@@ -98,6 +280,10 @@ class Game:
         Returns:
             Boolean representing if the interpretation was succesful.
         """
+        code = ACTION_CODES.get(user_input)
+        if code is not None:
+            # All of these keys take a turn, even if nothing happens.
+            self.actions.append(code)
 
         interpreted = True
         if user_input in DIRECTIONS.keys():
@@ -112,71 +298,181 @@ class Game:
             if isinstance(tile, entities.Entity):
                 # Fight implementation
                 monster = tile
-                monster.hp -= self.player.damage()
+                monster.hp -= self.player.damage(self.random.combat)
 
             if tile.walkable:
                 self.interface.msg("We're walking!")
-                self.player.move_relative(*direction)
+                self.current_level.move_creature(self.player, *new_pos)
 
-        elif user_input is " ":
+        elif user_input == " ":
             if self.player.bombs_n > 0:
                 self.current_level.put_bomb(self.player.y, self.player.x)
                 self.player.bombs_n -= 1
             else:
                 self.interface.msg("You don't have anymore bombs!")
 
-        elif user_input is ">":
-            tile = self.current_level.grid[self.player.y][self.player.x]
+        elif user_input == ">":
+            tile = self.current_level.tile_at(self.player.y, self.player.x)
             if isinstance(tile, levels.Stairs) and tile.axis == 1:
                 self.descend()
             else:
                 self.interface.msg("You can't descend here!")
+
+        elif user_input in RUN_KEYS or user_input == TRAVEL_KEY:
+            interpreted = self.start_run(user_input)
+
+        elif user_input == "S":
+            saves.save(self, self.save_path)
+            self.interface.msg("Game saved to {}".format(self.save_path))
+            # Saving doesn't take a turn.
+            self.draw()
+            interpreted = False
+
+        elif user_input == "P":
+            profiler.PROFILER.toggle_overlay()
+            self.draw()
+            interpreted = False
         else:
             interpreted = False
             self.interface.msg("I don't understand what you want me to do")
 
         return interpreted
 
-    def check_world_status(self):
-        """Looks for bombs and dead creatures and handles them accordingly."""
-        bombs = [entity for entity in self.current_level.creatures
-                 if isinstance(entity, entities.Bomb)]
+    def start_run(self, user_input):
+        """Starts running in a direction or travelling to the exit (see
+        running.Run) and takes the first step.
+
+        Args:
+            user_input (str): one of RUN_KEYS or TRAVEL_KEY.
+        Returns:
+            Boolean representing if the first step was taken.
+        """
+        level = self.current_level
+        if user_input == TRAVEL_KEY:
+            if not level.visibility[level.exit.y][level.exit.x]:
+                self.interface.msg("You haven't found the exit yet!")
+                return False
+            run = running.Run(self, target=(level.exit.y, level.exit.x))
+        else:
+            run = running.Run(self, direction=RUN_KEYS[user_input])
 
-        for bomb in bombs:
-            if bomb.time_till_blow <= 0:
-                self.current_level.explosion(bomb)
+        step = run.next_step()
+        if step is None:
+            self.interface.msg("You can't run there!")
+            return False
+        self.run = run
+        return self.interpret_input(STEP_KEYS[step])
 
-        for idx, creature in enumerate(self.current_level.creatures):
-            if creature.hp <= 0:
-                del self.current_level.creatures[idx]
+    def continue_run(self):
+        """Takes the next step of the run, unless it stops.
 
-    def world_tick(self):
-        """Simulates the world reaction - mainly NPCs behavior."""
-        self.current_level.tick()
+        Returns:
+            Boolean representing if the step was taken.
+        """
+        step = self.run.next_step()
+        if step is None:
+            self.run = None
+            return False
+        return self.interpret_input(STEP_KEYS[step])
 
-        for creature in self.current_level.creatures:
-            if isinstance(creature, entities.Player):
-                continue
-            room = self.current_level.grid[creature.y][creature.x]
-            visible_entities = [entity for entity
-                                in self.current_level.creatures
-                                if entity in room]
-            new_y, new_x = creature.make_action(visible_entities)
+    @profiler.timed("check_world_status")
+    def check_world_status(self):
+        """Looks for bombs and dead creatures and handles them accordingly."""
+        level = self.current_level
+        profiler.count("creatures scanned", len(level.creatures))
+        exploded = set()
+        for bomb in list(level.bombs):
+            if bomb.time_till_blow <= 0 and bomb not in exploded:
+                exploded.update(level.explosion(bomb))
+
+        # The player stays in the level after death, the main loop ends the
+        # game instead.
+        dead = level.npcs.dead()
+        dead += [bomb for bomb in level.bombs if bomb.hp <= 0]
+        level.remove_creatures(dead)
+
+    @profiler.timed("world_tick")
+    def world_tick(self):
+        """Simulates the world reaction - mainly NPCs behavior.
 
-            tile = self.current_level.get_tile((new_y, new_x))
+        All NPCs decide where to go first, then the conflicts between their
+        moves are resolved (see NPCStore.resolve_moves) and the moves and
+        attacks are carried out together.
+        """
+        level = self.current_level
+        level.tick()
 
-            if tile is None:
-                continue
+        for bomb in level.bombs:
+            bomb.make_action()
 
-            elif isinstance(tile, entities.Player):
-                self.player.hp -= creature.damage()
+        npc_store = level.npcs
+        profiler.count("creatures scanned", len(npc_store) + len(level.bombs))
+        intents = npc_store.plan_moves(level, level.random.ai)
+        moves, attackers = npc_store.resolve_moves(level, intents)
+        npcs_moved = [npc_store.handles[idx] for idx, _, _ in moves]
+        for npc, (_, new_y, new_x) in zip(npcs_moved, moves):
+            level.move_creature(npc, new_y, new_x)
 
-            elif tile.walkable:
-                creature.y = new_y
-                creature.x = new_x
+        self.player.hp -= sum(
+            self.random.combat.randint(1, npc_store.handles[idx].max_damage)
+            for idx in attackers)
 
 
 if __name__ == "__main__":
-    game = Game()
-    curses.wrapper(game.main_loop)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int,
+                        help="seed of the game, a 64-bit signed integer")
+    parser.add_argument("--height", type=int, default=levels.GAME_HEIGHT,
+                        help="height of the levels")
+    parser.add_argument("--width", type=int, default=levels.GAME_WIDTH,
+                        help="width of the levels")
+    parser.add_argument("--log-level", default="DEBUG",
+                        choices=["DEBUG", "INFO", "WARNING", "NONE"],
+                        help="minimal level of records logged to {}".format(
+                            misc.LOG_FILE))
+    parser.add_argument("--save", default=saves.SAVE_FILE,
+                        help="file the game is saved to by pressing S")
+    parser.add_argument("--load", metavar="SAVE",
+                        help="resume the game saved in the file")
+    parser.add_argument("--level-cache", metavar="DIRECTORY",
+                        help="load the levels from the cache in the "
+                        "directory, see level_cache.py")
+    parser.add_argument("--record", metavar="LOG",
+                        help="write the actions taken in the game to the "
+                        "file, see replay.py")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="profile the game and write the report (JSON) "
+                        "to the file, P toggles the profiler in the game")
+    args = parser.parse_args()
+    try:
+        levels.check_size(args.height, args.width)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.seed is not None and args.seed not in saves.SEED_RANGE:
+        parser.error("--seed has to be a 64-bit signed integer")
+    if args.load and args.record:
+        parser.error("games loaded from a save can't be recorded")
+
+    if args.log_level != "NONE":
+        misc.setup_logging(getattr(logging, args.log_level))
+
+    cache = None
+    if args.level_cache:
+        cache = level_cache.LevelCache(args.level_cache, height=args.height,
+                                       width=args.width)
+    game = Game(seed=args.seed, prefetch=True,
+                height=args.height, width=args.width, level_cache=cache)
+    game.save_path = args.save
+    if args.load:
+        saves.load(game, args.load)
+    if args.profile:
+        profiler.PROFILER.enabled = True
+
+    try:
+        curses.wrapper(game.main_loop)
+    finally:
+        if args.profile:
+            profiler.PROFILER.export(args.profile)
+        if args.record:
+            replay.save(game, args.record)
     game.farewell()
@@ -1,24 +1,41 @@
 """Various helper functions for CorporateRL game."""
-import datetime
+import atexit
+import logging
+import logging.handlers
+import queue
 import random
 
-DEBUG_ENABLED = True
-DEBUG_FILE = open("corporate.log", "a")
+LOG_FILE = "corporate.log"
+LOG_FORMAT = "%(asctime)s\t%(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Logging is disabled until setup_logging is called.
+LOGGER = logging.getLogger("corporate")
+LOGGER.addHandler(logging.NullHandler())
+LOGGER.setLevel(logging.CRITICAL + 1)
+LOGGER.propagate = False
+# The queue listener and handler installed by setup_logging.
+_LOG_LISTENER = None
 
 
 class GameObject():
     """Generic class representing a game object which has 2D position, width
     and height.
 
+    Game objects and their subclasses declare their attributes in __slots__,
+    so they don't carry a __dict__.
+
     Attributes:
-        y (int):
-        x (int):
-        w (int): width of the object.
-        h (int): height of the object.
+        y (int): vertical position of the object, also available as pos_y.
+        x (int): horizontal position of the object, also available as pos_x.
+        w (int): width of the object, also available as width.
+        h (int): height of the object, also available as height.
         _color (int): represents the curses color_pair of the object.
         walkable (boolean): whether the entities in the world can walk on this
         object.
     """
+    __slots__ = ("y", "x", "h", "w", "_color", "walkable")
+
     def __init__(self, pos_y, pos_x, height=1, width=1):
         """Creates the object with some generic attributes.
 
@@ -28,17 +45,49 @@ class GameObject():
             height (int): height of the object.
             width (int): width of the object.
         """
-        self.pos_y = pos_y
-        self.pos_x = pos_x
-        self.height = height
-        self.width = width
-        self.x = pos_x
         self.y = pos_y
-        self.w = width
+        self.x = pos_x
         self.h = height
+        self.w = width
         self._color = 0
         self.walkable = False
 
+    @property
+    def pos_y(self):
+        """Vertical position of the object, the same as y."""
+        return self.y
+
+    @pos_y.setter
+    def pos_y(self, value):
+        self.y = value
+
+    @property
+    def pos_x(self):
+        """Horizontal position of the object, the same as x."""
+        return self.x
+
+    @pos_x.setter
+    def pos_x(self, value):
+        self.x = value
+
+    @property
+    def height(self):
+        """Height of the object, the same as h."""
+        return self.h
+
+    @height.setter
+    def height(self, value):
+        self.h = value
+
+    @property
+    def width(self):
+        """Width of the object, the same as w."""
+        return self.w
+
+    @width.setter
+    def width(self, value):
+        self.w = value
+
     def __contains__(self, pos):
         """Check whether the given position ois "inside" the object.
 
@@ -61,44 +110,136 @@ class GameObject():
         return self._color
 
 
-def random_choice(container, size=None, probs=None):
+class RandomStreams():
+    """Class holding independent random numbers generators ("streams") of
+    different subsystems, all derived from a single seed. Drawing numbers in
+    one subsystem doesn't change the numbers drawn in the others.
+
+    Attributes:
+        seed: the seed the streams are derived from, None for streams seeded
+            from the system's randomness.
+        names (tuple): names of the streams, every stream is a Random object
+            available as the attribute with its name.
+    """
+
+    def __init__(self, seed, names):
+        """Creates the streams.
+
+        Args:
+            seed (int or str): the seed, the same seed gives the same streams.
+            names (iterable): names of the streams.
+        """
+        self.seed = seed
+        self.names = tuple(names)
+        for name in self.names:
+            stream_seed = None if seed is None else "{}-{}".format(seed, name)
+            setattr(self, name, random.Random(stream_seed))
+
+    def getstate(self):
+        """Get the state of all streams, see setstate."""
+        return tuple(getattr(self, name).getstate() for name in self.names)
+
+    def setstate(self, state):
+        """Bring all streams back to the state returned by getstate."""
+        for name, stream_state in zip(self.names, state):
+            getattr(self, name).setstate(stream_state)
+
+
+class WeightedSampler():
+    """Class drawing elements of a container with given weights, using the
+    alias method - the tables are built once, in linear time, and then every
+    draw takes constant time and a single random number.
+
+    Attributes:
+        container (list): elements to draw from.
+        probs (list of floats): for every slot, the probability of drawing its
+            own element rather than its alias.
+        aliases (list of ints): for every slot, the index of the alias.
+    """
+
+    def __init__(self, container, weights=None):
+        """Builds the alias tables.
+
+        Args:
+            container (iterable): the elements we'd like to draw.
+            weights (list of numbers): non-negative weights of elements, they
+                don't have to sum to one. Uniform by default.
+        """
+        self.container = list(container)
+        len_ = len(self.container)
+        if len_ == 0:
+            raise ValueError("Can't sample from an empty container!")
+        if weights is None:
+            weights = [1] * len_
+        if len(weights) != len_ or any(weight < 0 for weight in weights):
+            raise ValueError("There has to be a non-negative weight for "
+                             "every element!")
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("Weights sum to zero!")
+
+        scaled = [weight * len_ / total for weight in weights]
+        self.probs = [1.0] * len_
+        self.aliases = list(range(len_))
+        small = [idx for idx, prob in enumerate(scaled) if prob < 1]
+        large = [idx for idx, prob in enumerate(scaled) if prob >= 1]
+        while small and large:
+            small_idx = small.pop()
+            large_idx = large[-1]
+            self.probs[small_idx] = scaled[small_idx]
+            self.aliases[small_idx] = large_idx
+            scaled[large_idx] -= 1 - scaled[small_idx]
+            if scaled[large_idx] < 1:
+                small.append(large.pop())
+        # Whatever is left has probability one, up to the rounding errors.
+
+    def sample(self, rng=random):
+        """Draw one element.
+
+        Args:
+            rng (Random): random numbers generator to use, the global one by
+                default.
+        Returns:
+            The drawn element.
+        """
+        roll = rng.random() * len(self.container)
+        idx = int(roll)
+        if roll - idx >= self.probs[idx]:
+            idx = self.aliases[idx]
+        return self.container[idx]
+
+    def sample_many(self, size, rng=random):
+        """Draw multiple elements (with repetitions).
+
+        Args:
+            size (int): how many elements we'd like to draw.
+            rng (Random): random numbers generator to use.
+        Returns:
+            List of drawn elements of length size.
+        """
+        return [self.sample(rng) for _ in range(size)]
+
+
+def random_choice(container, size=None, probs=None, rng=random):
     """Helper function to implement random.choice with probabilities and
-    ability to choose element multiple times.
+    ability to choose element multiple times. For repeated choices from the
+    same container it's better to keep a WeightedSampler.
 
     Args:
         container (iterable): the container we'd like to choose from.
         size (int): how many element's we'd like to choose.
-        probs (list of ints): probabilities of elements
+        probs (list of numbers): probabilities (or any weights) of elements
+        rng (Random): random numbers generator to use, the global one by
+            default.
 
     Returns:
         Chosen element if size is None, otherwise list of chosen elements of
         length size.
     """
-    def get_element(container, probs):
-        """Gets the element with given container and probs.
-
-        Args:
-            container (iterable): the container we'd like to choose from.
-            probs (list of ints): probabilities of elements
-        Returns:
-            One element from the container.
-        """
-        roll = random.random()
-        debug("Roll:", roll)
-        probs_sum = 0
-        for idx, prob in enumerate(probs):
-            probs_sum += prob
-            if roll <= probs_sum:
-                return container[idx]
-        raise ValueError("Probs don't sum to one?!")
-
-    len_ = len(container)
-    if probs is None:
-        probs = [1 / len_ for _ in range(len_)]
-
+    sampler = WeightedSampler(container, probs)
     if size is None:
-        return get_element(container, probs)
-    return [get_element(container, probs) for _ in range(size)]
+        return sampler.sample(rng)
+    return sampler.sample_many(size, rng)
 
 
 def sign(x):
@@ -115,15 +256,47 @@ def sign(x):
     return 1 if x > 0 else -1
 
 
+def setup_logging(level=logging.DEBUG, filename=LOG_FILE):
+    """Enables logging records of the given level and above to the file.
+
+    The records are passed through a queue to a background thread, which
+    formats and writes them. The file is opened with the first record.
+    Calling it again replaces the previous setup, so that records aren't
+    written twice.
+
+    Args:
+        level (int): minimal level of logged records, e.g. logging.INFO.
+        filename (str): path of the log file.
+    """
+    global _LOG_LISTENER
+    if _LOG_LISTENER is not None:
+        listener, queue_handler = _LOG_LISTENER
+        LOGGER.removeHandler(queue_handler)
+        listener.stop()
+        atexit.unregister(listener.stop)
+        for handler in listener.handlers:
+            handler.close()
+
+    log_queue = queue.SimpleQueue()
+    file_handler = logging.FileHandler(filename, delay=True)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    LOGGER.addHandler(queue_handler)
+    LOGGER.setLevel(level)
+    _LOG_LISTENER = (listener, queue_handler)
+
+
 def debug(*args):
-    """Helper function for printing to the log file."""
-    strargs = [str(arg) for arg in args]
-    msg = "\t".join(strargs)
-    if DEBUG_ENABLED:
-        time_now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        msg = time_now + "\t" + msg
-        if DEBUG_FILE:
-            DEBUG_FILE.write(msg + "\n")
-            DEBUG_FILE.flush()
-        else:
-            print(msg)
+    """Helper function for logging debug records. Arguments are joined with
+    tabs - only if debug records are enabled, otherwise nothing is
+    formatted.
+
+    Args:
+        args: anything to log.
+    """
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("\t".join(str(arg) for arg in args))
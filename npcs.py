@@ -0,0 +1,237 @@
+"""Storage and batched turns of the NPCs of a CorporateRL level."""
+import array
+import random
+
+import entities
+import levels
+import misc
+
+
+ZOMBIE = 0
+KINDS = {entities.CorporateZombie: ZOMBIE}
+
+
+class NPCStore():
+    """Class keeping the NPCs of a level in the order their turns are
+    computed in, so that the turn of all of them is planned and resolved in
+    a single batch instead of NPC by NPC (see plan_moves and
+    resolve_moves).
+
+    The NPC objects (see CorporateZombie) keep their own position, hp and
+    damage - the store only knows their slots, kinds and ids. NPCs stay in
+    the order they were added (the order of their ids).
+
+    Attributes:
+        kinds (array of ints): kind of every NPC, e.g. ZOMBIE.
+        ids (array of ints): unique, increasing numbers given to NPCs as
+            they are added, they don't change when other NPCs are removed.
+        handles (list): NPC objects, in the same order as the arrays.
+        next_id (int): id of the next NPC added.
+    """
+
+    def __init__(self):
+        """Creates an empty store."""
+        self.kinds = array.array("b")
+        self.ids = array.array("i")
+        self.handles = []
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.handles)
+
+    @property
+    def columns(self):
+        """All arrays of the store."""
+        return (self.kinds, self.ids)
+
+    def add(self, npc):
+        """Add the NPC to the store.
+
+        Args:
+            npc (CorporateZombie): NPC not stored anywhere yet.
+        """
+        npc.index = len(self.handles)
+        self.kinds.append(KINDS[type(npc)])
+        self.ids.append(self.next_id)
+        self.handles.append(npc)
+        self.next_id += 1
+
+    def remove(self, npc):
+        """Take the NPC out of the store.
+
+        Args:
+            npc (CorporateZombie): NPC in the store.
+        """
+        self.remove_many([npc])
+
+    def remove_many(self, removed_npcs):
+        """Take the NPCs out of the store with one pass over the arrays, the
+        remaining NPCs keep their order.
+
+        Args:
+            removed_npcs (list): NPCs in the store, each of them once.
+        """
+        if not removed_npcs:
+            return
+        removed = set()
+        for npc in removed_npcs:
+            removed.add(npc.index)
+            npc.index = -1
+
+        # The NPCs before the first removed one stay where they are.
+        start = min(removed)
+        kept = [idx for idx in range(start, len(self.handles))
+                if idx not in removed]
+        for column in self.columns:
+            column[start:] = array.array(column.typecode,
+                                         [column[idx] for idx in kept])
+        self.handles[start:] = [self.handles[idx] for idx in kept]
+        for idx in range(start, len(self.handles)):
+            self.handles[idx].index = idx
+
+    def snapshot(self):
+        """Capture the state of the store, see restore.
+
+        Returns:
+            Tuple (columns, npcs, next_id) - the arrays as bytes, tuples
+            (NPC object, y, x, hp, max_damage) and the next id to give.
+        """
+        return (tuple(column.tobytes() for column in self.columns),
+                tuple((npc, npc.y, npc.x, npc.hp, npc.max_damage)
+                      for npc in self.handles),
+                self.next_id)
+
+    def restore(self, snapshot):
+        """Bring the store back to the captured state. NPCs in the store
+        which aren't in the snapshot are detached from it, the ones which
+        are get their captured state back.
+
+        Args:
+            snapshot (tuple): state returned by snapshot.
+        """
+        columns, states, next_id = snapshot
+        for npc in self.handles:
+            npc.index = -1
+
+        for column, data in zip(self.columns, columns):
+            del column[:]
+            column.frombytes(data)
+        self.handles = [npc for npc, _, _, _, _ in states]
+        for idx, (npc, y, x, hp, max_damage) in enumerate(states):
+            npc.index = idx
+            npc.y, npc.x, npc.hp, npc.max_damage = y, x, hp, max_damage
+        self.next_id = next_id
+
+    def dead(self):
+        """Get all NPCs without health points.
+
+        Returns:
+            List of NPC objects with hp <= 0.
+        """
+        return [npc for npc in self.handles if npc.hp <= 0]
+
+    def plan_moves(self, level, rng=random):
+        """Compute where every NPC wants to move this turn.
+
+        An NPC standing in a room sees the player if they are in the same
+        room, otherwise it sees only its own tile. NPCs seeing the player
+        walk towards them along the flow field (or straight at them, if the
+        flow field doesn't reach them), the others roam randomly.
+
+        Args:
+            level (Level): the level of the NPCs.
+            rng (Random): random numbers generator for roaming NPCs.
+        Returns:
+            List of target positions (y, x), one for every NPC.
+        """
+        player = level.player
+        player_room = level.room_ids[player.y][player.x]
+        terrain = level.terrain
+        room_ids = level.room_ids
+        flow_field = level.flow_field
+
+        intents = []
+        for npc in self.handles:
+            y, x = npc.y, npc.x
+            room = room_ids[y][x]
+            sees_player = ((y == player.y and x == player.x) or
+                           (room >= 0 and room == player_room and
+                            terrain[y][x] == levels.FLOOR))
+            if not sees_player:
+                intents.append((y + rng.randint(-1, 1),
+                                x + rng.randint(-1, 1)))
+                continue
+
+            step = flow_field.next_step(y, x)
+            if step is None:
+                step = (y + misc.sign(player.y - y),
+                        x + misc.sign(player.x - x))
+            intents.append(step)
+        return intents
+
+    def resolve_moves(self, level, intents):
+        """Decide which of the planned moves happen, so that the result
+        doesn't depend on the order of NPCs in the store.
+
+        Every intent is checked against the level as it was at the beginning
+        of the turn:
+            - NPCs targeting the player attack them,
+            - moves out of the level or onto unwalkable terrain fail,
+            - when several NPCs target the same tile, the one with the lowest
+              id wins, the rest stay,
+            - a winner moves only if everything standing on its target moves
+              away as well. So NPCs may follow each other in a queue, swap
+              places or walk in a circle, but not walk into a bomb or an NPC
+              which stays.
+
+        Args:
+            level (Level): the level of the NPCs.
+            intents (list): target positions (y, x), one for every NPC.
+        Returns:
+            Tuple (moves, attackers): moves is a list of (index, y, x), sorted
+            by NPCs' ids, attackers is a list of indices of NPCs attacking
+            the player.
+        """
+        player = level.player
+        attackers = []
+        winners = {}
+        handles = self.handles
+        for idx, (new_y, new_x) in enumerate(intents):
+            npc = handles[idx]
+            if new_y == npc.y and new_x == npc.x:
+                continue
+            if new_y == player.y and new_x == player.x:
+                attackers.append(idx)
+                continue
+            if (not level.in_bounds(new_y, new_x)
+                    or not level.is_walkable(new_y, new_x)):
+                continue
+
+            target = (new_y, new_x)
+            rival = winners.get(target)
+            if rival is None or self.ids[idx] < self.ids[rival]:
+                winners[target] = idx
+
+        # Assume every winner moves, then take back the moves of those who
+        # are blocked, which blocks whoever wanted to move onto their tiles.
+        moving = set(winners.values())
+        blocked = []
+        for target, idx in winners.items():
+            for occupant in level.occupants.get(target, []):
+                if (type(occupant) not in KINDS
+                        or occupant.index not in moving):
+                    blocked.append(idx)
+                    break
+
+        while blocked:
+            idx = blocked.pop()
+            if idx not in moving:
+                continue
+            moving.remove(idx)
+            follower = winners.get((handles[idx].y, handles[idx].x))
+            if follower is not None:
+                blocked.append(follower)
+
+        moves = [(idx, intents[idx][0], intents[idx][1])
+                 for idx in sorted(moving, key=lambda idx: self.ids[idx])]
+        return moves, attackers
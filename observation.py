@@ -0,0 +1,124 @@
+"""Tensor observation encoder for CorporateRL levels.
+
+The encoder keeps a multi-channel array of bytes of shape (channels, height,
+width) which is updated incrementally by the level it's attached to, so
+getting an observation doesn't require walking the level. The array may be
+wrapped without copying, e.g. with numpy.frombuffer(encoder.buffer, "uint8").
+"""
+import entities
+import levels
+
+
+CHANNELS = ("wall", "door", "stairs", "visible", "zombie", "bomb", "player")
+WALL, DOOR, STAIRS, VISIBLE, ZOMBIE, BOMB, PLAYER = range(len(CHANNELS))
+
+
+class ObservationEncoder:
+    """Class representing the observation of a single level.
+
+    Every channel is a height x width plane of bytes:
+        wall, door, visible, player: 1 where present, 0 elsewhere,
+        stairs: 1 for the entrance, 2 for the exit,
+        zombie: number of zombies on the tile,
+        bomb: turns left until the bomb on the tile explodes.
+
+    Attributes:
+        height, width (ints): dimensions of the level.
+        buffer (bytearray): the channels, one after another, row-major.
+    """
+
+    def __init__(self, height, width):
+        """Creates an empty observation of the given size.
+
+        Args:
+            height (int): height of the level.
+            width (int): width of the level.
+        """
+        self.height = height
+        self.width = width
+        self._plane = height * width
+        self.buffer = bytearray(len(CHANNELS) * self._plane)
+
+    def view(self):
+        """Get the observation without copying it.
+
+        Returns:
+            memoryview of the buffer with shape (channels, height, width).
+            It reflects all later changes to the level.
+        """
+        return memoryview(self.buffer).cast(
+            "B", (len(CHANNELS), self.height, self.width))
+
+    def _offset(self, channel, y, x):
+        """Get the index of the given cell of the channel in the buffer."""
+        return channel * self._plane + y * self.width + x
+
+    def encode_level(self, level):
+        """Encode the whole level from scratch.
+
+        Args:
+            level (Level): level to encode.
+        """
+        self.buffer[:] = bytes(len(self.buffer))
+        for y, row in enumerate(level.terrain):
+            for x, code in enumerate(row):
+                self.set_tile(y, x, code)
+                if level.visibility[y][x]:
+                    self.buffer[self._offset(VISIBLE, y, x)] = 1
+
+        for pos, occupants in level.occupants.items():
+            self.set_occupants(pos[0], pos[1], occupants)
+
+    def set_tile(self, y, x, code):
+        """Encode the architecture at the given position.
+
+        Args:
+            y, x (ints): position of the tile.
+            code (int): code of the tile in the level's terrain.
+        """
+        stairs = 0
+        if code == levels.ENTRANCE:
+            stairs = 1
+        elif code == levels.EXIT:
+            stairs = 2
+
+        self.buffer[self._offset(WALL, y, x)] = code in levels.WALL_CODES
+        self.buffer[self._offset(DOOR, y, x)] = code == levels.DOOR
+        self.buffer[self._offset(STAIRS, y, x)] = stairs
+
+    def set_visible(self, top_edge, left_edge, bottom_edge, right_edge,
+                    visible):
+        """Encode the visibility of a rectangular area.
+
+        Args:
+            top_edge, left_edge, bottom_edge, right_edge (ints): bounds of the
+                area, bottom and right edges excluded.
+            visible (boolean): the visibility to set.
+        """
+        value = b"\x01" if visible else b"\x00"
+        row = value * (right_edge - left_edge)
+        for y in range(top_edge, bottom_edge):
+            start = self._offset(VISIBLE, y, left_edge)
+            self.buffer[start:start + len(row)] = row
+
+    def set_occupants(self, y, x, occupants):
+        """Encode the creatures standing at the given position.
+
+        Args:
+            y, x (ints): position of the tile.
+            occupants (list): all creatures at the position.
+        """
+        zombies = 0
+        fuse = 0
+        player = 0
+        for creature in occupants:
+            if isinstance(creature, entities.CorporateZombie):
+                zombies += 1
+            elif isinstance(creature, entities.Bomb):
+                fuse = max(fuse, max(1, creature.time_till_blow))
+            elif isinstance(creature, entities.Player):
+                player = 1
+
+        self.buffer[self._offset(ZOMBIE, y, x)] = min(zombies, 255)
+        self.buffer[self._offset(BOMB, y, x)] = min(fuse, 255)
+        self.buffer[self._offset(PLAYER, y, x)] = player
@@ -0,0 +1,212 @@
+"""Path finding shared by all NPCs of a CorporateRL level."""
+import collections
+import operator
+
+import levels
+import misc
+
+
+NEIGHBOURS = [(delta_y, delta_x) for delta_y in (-1, 0, 1)
+              for delta_x in (-1, 0, 1) if delta_y or delta_x]
+
+
+class FlowField():
+    """Class representing the distance map from the player to every walkable
+    tile of the level (moving in eight directions, ignoring creatures).
+
+    The map is computed at most once per turn, only when some NPC asks for it,
+    and shared by all of them. When the player hasn't moved, but some walls
+    were destroyed, it's updated incrementally from the destroyed tiles.
+
+    Tiles are indexed in a flat array with a one-tile border of unwalkable
+    tiles around the level, so neighbours don't need bounds checks.
+
+    Attributes:
+        level (Level): the level the map is computed for.
+        walkable (bytearray): 1 for walkable tiles, 0 elsewhere.
+        distances (list of ints): distance to the player, -1 for unreachable
+            tiles.
+        source (int): index of the tile the distances are computed from, None
+            if they haven't been computed.
+    """
+
+    def __init__(self, level):
+        """Creates the field for the given level, without computing it.
+
+        Args:
+            level (Level): the level, with its terrain already generated.
+        """
+        self.level = level
+        self._stride = level.width + 2
+        self._offsets = [delta_y * self._stride + delta_x
+                         for delta_y, delta_x in NEIGHBOURS]
+
+        self.walkable = bytearray(self._stride * (level.height + 2))
+        for y, row in enumerate(level.terrain):
+            start = self._index(y, 0)
+            self.walkable[start:start + level.width] = row.translate(
+                levels.WALKABLE_TABLE)
+
+        self.distances = [-1] * len(self.walkable)
+        self.source = None
+        self._opened = []
+        self._closed = False
+
+    def _index(self, y, x):
+        """Get the index of the tile at the given position."""
+        return (y + 1) * self._stride + x + 1
+
+    def tile_changed(self, y, x):
+        """Note the change of the terrain at the given position, taken into
+        account with the next update.
+
+        Args:
+            y, x (ints): position of the changed tile.
+        """
+        idx = self._index(y, x)
+        walkable = self.level.is_walkable(y, x)
+        if walkable and not self.walkable[idx]:
+            self._opened.append(idx)
+        elif not walkable and self.walkable[idx]:
+            self._closed = True
+        self.walkable[idx] = walkable
+
+    def target(self):
+        """Get the position the distances are computed to - the player's."""
+        return self.level.player.y, self.level.player.x
+
+    def update(self):
+        """Bring the distances up to date with the target's position and the
+        terrain."""
+        source = self._index(*self.target())
+        if source != self.source or self._closed:
+            self._compute(source)
+        elif self._opened:
+            self._relax(self._opened)
+        self._opened = []
+        self._closed = False
+
+    def _compute(self, source):
+        """Compute all distances from scratch with breadth-first search."""
+        self.source = source
+        self.distances = [-1] * len(self.walkable)
+        self.distances[source] = 0
+        self._propagate(collections.deque([source]))
+
+    def _relax(self, opened):
+        """Update the distances after the given tiles became walkable - the
+        distances may only get shorter."""
+        distances = self.distances
+        queue = collections.deque()
+        for idx in opened:
+            if not self.walkable[idx]:
+                continue
+            reached = [distances[idx + offset] for offset in self._offsets
+                       if distances[idx + offset] >= 0]
+            if reached and (distances[idx] < 0
+                            or min(reached) + 1 < distances[idx]):
+                distances[idx] = min(reached) + 1
+                queue.append(idx)
+        self._propagate(queue)
+
+    def _propagate(self, queue):
+        """Spread the distances from the tiles in the queue to their
+        neighbours, as long as it makes them shorter."""
+        distances = self.distances
+        walkable = self.walkable
+        offsets = self._offsets
+        while queue:
+            idx = queue.popleft()
+            distance = distances[idx] + 1
+            for offset in offsets:
+                neighbour = idx + offset
+                if walkable[neighbour] and (distances[neighbour] < 0 or
+                                            distances[neighbour] > distance):
+                    distances[neighbour] = distance
+                    queue.append(neighbour)
+
+    def snapshot(self):
+        """Capture the state of the field, see restore.
+
+        Returns:
+            Tuple of the walkable tiles, distances and pending changes.
+        """
+        return (bytes(self.walkable), tuple(self.distances), self.source,
+                tuple(self._opened), self._closed)
+
+    def restore(self, snapshot):
+        """Bring the field back to the captured state.
+
+        Args:
+            snapshot (tuple): state returned by snapshot.
+        """
+        walkable, distances, self.source, opened, self._closed = snapshot
+        self.walkable[:] = walkable
+        self.distances = list(distances)
+        self._opened = list(opened)
+
+    def distance(self, y, x):
+        """Get the distance from the given position to the player.
+
+        Returns:
+            Number of moves, -1 if the player can't be reached.
+        """
+        self.update()
+        return self.distances[self._index(y, x)]
+
+    def next_step(self, y, x):
+        """Get the best move from the given position towards the target.
+
+        Moves in the straight direction towards the target are preferred
+        when there are several equally good ones.
+
+        Args:
+            y, x (ints): the current position.
+        Returns:
+            Position (y, x) after the move, None if the target can't be
+            reached from the current position.
+        """
+        self.update()
+        if self.distances[self._index(y, x)] < 0:
+            return None
+
+        target_y, target_x = self.target()
+        preferred = (misc.sign(target_y - y), misc.sign(target_x - x))
+        best = None
+        best_distance = None
+        for delta_y, delta_x in [preferred] + NEIGHBOURS:
+            distance = self.distances[self._index(y + delta_y, x + delta_x)]
+            if distance >= 0 and (best is None or distance < best_distance):
+                best = (y + delta_y, x + delta_x)
+                best_distance = distance
+        return best
+
+
+class TravelMap(FlowField):
+    """Class representing the distance map from every tile the player has
+    seen to a fixed target, e.g. the exit, for travelling there.
+
+    Unseen tiles are treated as unwalkable, so the player only travels
+    through the parts of the level they know. The map isn't updated when the
+    terrain changes, travel is stopped instead if the way gets blocked.
+    """
+
+    def __init__(self, level, y, x):
+        """Computes the map.
+
+        Args:
+            level (Level): the level.
+            y, x (ints): position of the target.
+        """
+        super().__init__(level)
+        self._target = (y, x)
+        for y_, row in enumerate(level.visibility):
+            start = self._index(y_, 0)
+            walkable = self.walkable[start:start + level.width]
+            self.walkable[start:start + level.width] = bytes(
+                map(operator.and_, walkable, row))
+        self.update()
+
+    def target(self):
+        """Get the position the distances are computed to."""
+        return self._target
@@ -0,0 +1,136 @@
+"""Low-overhead instrumentation of the phases of CorporateRL turns.
+
+Phases are timed by decorating the functions implementing them with timed,
+and the work done in them is measured with counters. Both are collected by
+PROFILER, which is disabled by default - then the timed functions only check
+a flag and counters aren't touched.
+"""
+import functools
+import json
+import time
+
+
+class Profiler():
+    """Class collecting the timings and counters of the game.
+
+    Attributes:
+        enabled (boolean): whether anything is collected.
+        overlay (boolean): whether the game shows the summary on the screen.
+        timings (dict): maps phases to lists [number of calls, total time,
+            longest call], times in seconds.
+        counters (dict): maps names of counters to their values.
+    """
+
+    def __init__(self):
+        """Creates a disabled profiler."""
+        self.enabled = False
+        self.overlay = False
+        self.timings = {}
+        self.counters = {}
+        self._enabled_by_overlay = False
+
+    def reset(self):
+        """Forget everything collected so far."""
+        self.timings = {}
+        self.counters = {}
+
+    def toggle_overlay(self):
+        """Show or hide the overlay. Showing it enables the profiler, hiding
+        it disables the profiler again, unless it was enabled before (e.g.
+        for exporting the report)."""
+        self.overlay = not self.overlay
+        if self.overlay:
+            self._enabled_by_overlay = not self.enabled
+            self.enabled = True
+        elif self._enabled_by_overlay:
+            self.enabled = False
+            self._enabled_by_overlay = False
+
+    def record(self, phase, elapsed):
+        """Record a single run of the phase.
+
+        Args:
+            phase (str): name of the phase.
+            elapsed (float): duration of the run in seconds.
+        """
+        timing = self.timings.get(phase)
+        if timing is None:
+            self.timings[phase] = [1, elapsed, elapsed]
+        else:
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def report(self):
+        """Get everything collected so far.
+
+        Returns:
+            Dictionary with "phases" - for every phase the number of calls
+            and the total, mean and longest time in milliseconds - and
+            "counters".
+        """
+        phases = {}
+        for phase, (calls, total, longest) in sorted(self.timings.items()):
+            phases[phase] = {"calls": calls,
+                             "total_ms": total * 1000,
+                             "mean_ms": total * 1000 / calls,
+                             "max_ms": longest * 1000}
+        return {"phases": phases, "counters": dict(sorted(
+            self.counters.items()))}
+
+    def summary(self):
+        """Get the report as short lines of text, e.g. for the overlay.
+
+        Returns:
+            List of strings, one per phase and counter.
+        """
+        report = self.report()
+        lines = ["{:<20} {:>7} calls {:>9.3f} ms avg {:>9.3f} ms max".format(
+            phase, timing["calls"], timing["mean_ms"], timing["max_ms"])
+                 for phase, timing in report["phases"].items()]
+        lines += ["{:<20} {:>7}".format(name, value)
+                  for name, value in report["counters"].items()]
+        return lines
+
+    def export(self, path):
+        """Write the report to the file as JSON.
+
+        Args:
+            path (str): path of the file.
+        """
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+PROFILER = Profiler()
+
+
+def timed(phase):
+    """Decorator timing every call of the function as the given phase.
+
+    Args:
+        phase (str): name of the phase.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                PROFILER.record(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """Increase the counter with the given name, if the profiler is enabled.
+
+    Args:
+        name (str): name of the counter.
+        value (int): the increase.
+    """
+    if PROFILER.enabled:
+        PROFILER.counters[name] = PROFILER.counters.get(name, 0) + value
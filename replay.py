@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""Action logs of CorporateRL games and their headless replays.
+
+A game is reproduced exactly by its seed, the dimensions of its levels and
+the actions taken in it (see main.ACTIONS), so that's all an action log
+keeps - a header followed by one byte per turn:
+
+    header      magic, format version, seed, height, width, number of
+                actions
+    actions     codes of the actions, see main.ACTIONS
+
+Replays run the game headless, as fast as possible, and keep its snapshots
+every few turns (keyframes), so that any turn may be reached by restoring
+the nearest earlier keyframe and replaying only the turns after it.
+
+    python main.py --record game.log
+    python replay.py game.log --turn 1500 --view
+"""
+import argparse
+import bisect
+import collections
+import curses
+import struct
+import time
+
+import interface
+import main
+
+
+MAGIC = b"CRLR"
+VERSION = 1
+HEADER = struct.Struct("<4sHxxqiiI")
+KEYFRAME_INTERVAL = 100
+
+# Contents of an action log.
+ActionLog = collections.namedtuple("ActionLog", [
+    "seed", "height", "width", "actions"])
+
+
+def dumps(game):
+    """Serialize the actions taken in the game so far.
+
+    Args:
+        game (Game): the recorded game, started with a new level (not loaded
+            from a save).
+    Returns:
+        The action log as bytes.
+    """
+    return HEADER.pack(MAGIC, VERSION, game.seed, game.height, game.width,
+                       len(game.actions)) + bytes(game.actions)
+
+
+def loads(data):
+    """Read the action log.
+
+    Args:
+        data (bytes-like): the log returned by dumps.
+    Returns:
+        ActionLog with the actions as bytes.
+    """
+    magic, version, seed, height, width, actions_n = HEADER.unpack_from(
+        data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a CorporateRL action log")
+    if version != VERSION:
+        raise ValueError("Unsupported action log version: {}".format(
+            version))
+
+    actions = bytes(data[HEADER.size:HEADER.size + actions_n])
+    if len(actions) != actions_n:
+        raise ValueError("The action log is truncated")
+    if actions and max(actions) >= len(main.ACTIONS):
+        raise ValueError("Unknown action code: {}".format(max(actions)))
+    return ActionLog(seed, height, width, actions)
+
+
+def save(game, path):
+    """Write the game's action log to the file."""
+    with open(path, "wb") as log_file:
+        log_file.write(dumps(game))
+
+
+def load(path):
+    """Read the action log from the file, see loads."""
+    with open(path, "rb") as log_file:
+        return loads(log_file.read())
+
+
+class Replay():
+    """Class replaying an action log in a headless game, with seeking to any
+    turn.
+
+    Turns are played in the order of Game.main_loop - the world moves once
+    before the first action, then every action is followed by the world's
+    reaction, as long as the player lives.
+
+    Attributes:
+        log (ActionLog): the replayed log.
+        game (Game): the game the log is replayed in, its interface is
+            a NullInterface unless replaced (e.g. by a viewer).
+        turn (int): number of actions replayed so far.
+        keyframe_interval (int): number of turns between keyframes.
+        keyframes (dict): maps turns to game snapshots taken after them,
+            without the actions, which are in the log.
+    """
+
+    def __init__(self, log, keyframe_interval=KEYFRAME_INTERVAL):
+        """Starts the game of the log, at turn 0.
+
+        Args:
+            log (ActionLog): the log to replay.
+            keyframe_interval (int): number of turns between keyframes, more
+                frequent keyframes make seeking faster, but take memory.
+        """
+        self.log = log
+        self.keyframe_interval = keyframe_interval
+        self.game = main.Game(seed=log.seed, height=log.height,
+                              width=log.width)
+        self.game.start(interface.NullInterface())
+        self.game.world_tick()
+        self.game.check_world_status()
+
+        self.turn = 0
+        self.keyframes = {0: self.game.snapshot(actions=False)}
+        self._keyframe_turns = [0]
+
+    def __len__(self):
+        """Number of turns in the log."""
+        return len(self.log.actions)
+
+    def step(self):
+        """Replay the next action and the world's reaction to it.
+
+        Returns:
+            False if the log has ended, True otherwise.
+        """
+        if self.turn >= len(self.log.actions):
+            return False
+
+        game = self.game
+        game.interpret_input(main.ACTIONS[self.log.actions[self.turn]])
+        # As in Game.main_loop, the world doesn't react to the last action
+        # of a player who has died.
+        if game.player.hp > 0:
+            game.world_tick()
+            game.check_world_status()
+        self.turn += 1
+
+        if (self.turn % self.keyframe_interval == 0
+                and self.turn not in self.keyframes):
+            self.keyframes[self.turn] = game.snapshot(actions=False)
+            bisect.insort(self._keyframe_turns, self.turn)
+        return True
+
+    def seek(self, turn):
+        """Bring the game to the state after the given turn, restoring the
+        nearest keyframe and replaying the turns after it.
+
+        Args:
+            turn (int): the turn, clamped to the length of the log.
+        """
+        turn = max(0, min(turn, len(self.log.actions)))
+        keyframe = self._keyframe_turns[
+            bisect.bisect_right(self._keyframe_turns, turn) - 1]
+        if not keyframe <= self.turn <= turn:
+            self.game.restore(self.keyframes[keyframe])
+            self.game.actions[:] = self.log.actions[:keyframe]
+            self.turn = keyframe
+        while self.turn < turn:
+            self.step()
+
+    def run(self):
+        """Replay the rest of the log."""
+        self.seek(len(self.log.actions))
+
+
+def view(stdscr, replay):
+    """Show the replay with curses, turn by turn.
+
+    Keys: . or right arrow - next turn, , or left arrow - previous turn,
+    ] and [ - jump by the keyframe interval, q - quit.
+
+    Args:
+        stdscr (window): the curses window.
+        replay (Replay): the replay, shown from its current turn.
+    """
+    game = replay.game
+    game.interface = interface.Interface(stdscr)
+    moves = {".": 1, "KEY_RIGHT": 1, ",": -1, "KEY_LEFT": -1,
+             "]": replay.keyframe_interval, "[": -replay.keyframe_interval}
+    while True:
+        game.interface.msg("Turn {}/{} - . , [ ] to move, q to quit".format(
+            replay.turn, len(replay)))
+        game.draw()
+        key = game.interface.get_user_input()
+        if key == "q":
+            break
+        if key in moves:
+            replay.seek(replay.turn + moves[key])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="the action log, see main.py --record")
+    parser.add_argument("--turn", type=int,
+                        help="turn to go to, the end of the log by default")
+    parser.add_argument("--keyframe-interval", type=int,
+                        default=KEYFRAME_INTERVAL,
+                        help="number of turns between keyframes")
+    parser.add_argument("--view", action="store_true",
+                        help="show the game from the turn on, with curses")
+    args = parser.parse_args()
+
+    replay_ = Replay(load(args.log), args.keyframe_interval)
+    start = time.perf_counter()
+    replay_.seek(len(replay_) if args.turn is None else args.turn)
+    elapsed = time.perf_counter() - start
+
+    game_ = replay_.game
+    print("Turn {}/{} replayed in {:.3f} s: level {}, HP {}/{}, "
+          "bombs {}, position ({}, {})".format(
+              replay_.turn, len(replay_), elapsed, game_.level_num,
+              game_.player.hp, game_.player.max_hp, game_.player.bombs_n,
+              game_.player.y, game_.player.x))
+    if args.view:
+        curses.wrapper(view, replay_)
@@ -0,0 +1,101 @@
+"""Running and travelling in CorporateRL - moving the player for many turns
+with a single command, until something interesting happens."""
+import levels
+import pathfinding
+
+
+# Tiles the player stops running on.
+STOP_CODES = (levels.DOOR, levels.ENTRANCE, levels.EXIT)
+
+
+class Run():
+    """Class representing a run in a straight line or travel to a target
+    (e.g. the exit), which the game carries out one step per turn.
+
+    The run stops when a monster comes into view or stands next to the
+    player, when the player loses health points or when the way is blocked.
+    Runs in a straight line also stop on doors and stairs.
+
+    Attributes:
+        game (Game): the game the player runs in.
+        level (Level): the level the run started in.
+        direction (tuple of ints): direction of a run in a straight line,
+            None when travelling.
+        travel_map (TravelMap): distances to the target when travelling,
+            None when running in a straight line.
+        hp (int): the player's health points after the last step.
+        monsters (set): monsters in view after the last step.
+        steps (int): number of steps taken so far.
+    """
+
+    def __init__(self, game, direction=None, target=None):
+        """Starts the run, without taking any step.
+
+        Args:
+            game (Game): the game.
+            direction (tuple of ints): direction (delta_y, delta_x) to run
+                in.
+            target (tuple of ints): position (y, x) to travel to, through
+                the tiles the player has seen, if no direction is given.
+        """
+        self.game = game
+        self.level = game.current_level
+        self.direction = direction
+        self.travel_map = None
+        if direction is None:
+            self.travel_map = pathfinding.TravelMap(self.level, *target)
+        self.hp = game.player.hp
+        self.monsters = self.monsters_in_view()
+        self.steps = 0
+
+    def monsters_in_view(self):
+        """Get the monsters standing on the tiles the player sees.
+
+        Returns:
+            Set of NPC objects.
+        """
+        visibility = self.level.visibility
+        return {npc for npc in self.level.npcs.handles
+                if visibility[npc.y][npc.x]}
+
+    def next_step(self):
+        """Decide whether the run goes on and where.
+
+        Returns:
+            Direction (delta_y, delta_x) of the next step, None if the run
+            stops.
+        """
+        level = self.level
+        player = self.game.player
+        if (self.game.current_level is not level or player.hp <= 0
+                or player.hp < self.hp
+                or self.steps >= level.height * level.width):
+            return None
+        self.hp = player.hp
+
+        monsters = self.monsters_in_view()
+        new_monsters = monsters - self.monsters
+        self.monsters = monsters
+        if new_monsters or any(abs(npc.y - player.y) <= 1
+                               and abs(npc.x - player.x) <= 1
+                               for npc in monsters):
+            return None
+
+        if self.direction is not None:
+            if (self.steps
+                    and level.terrain[player.y][player.x] in STOP_CODES):
+                return None
+            new_y = player.y + self.direction[0]
+            new_x = player.x + self.direction[1]
+        else:
+            step = self.travel_map.next_step(player.y, player.x)
+            if step is None or step == (player.y, player.x):
+                return None
+            new_y, new_x = step
+
+        if (not level.in_bounds(new_y, new_x)
+                or not level.is_walkable(new_y, new_x)
+                or level.occupants.get((new_y, new_x))):
+            return None
+        self.steps += 1
+        return new_y - player.y, new_x - player.x
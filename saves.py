@@ -0,0 +1,436 @@
+"""Binary save format of CorporateRL games.
+
+A save is a flat little-endian record, so it may be read straight out of
+a memory-mapped archive without unpickling anything:
+
+    header      magic, format version, game and player fields (with the
+                player's place among the creatures on their tile), counts
+    rng states  the game's and the level's random numbers streams
+    rooms       fixed-width records (y, x, h, w, visible)
+    terrain     height * width tile codes, row-major (see levels)
+    visibility  height * width bytes, 1 where visible
+    entities    fixed-width records (kind, y, x, hp, aux, id) of all
+                creatures except the player, in the level's order
+
+A level record (see dumps_level) stores a level which nobody has entered
+yet, e.g. a freshly generated one, the same way - its header is followed by
+the level's random numbers streams, rooms, terrain, visibility and
+entities.
+
+An archive is a header, a table of offsets and sizes of the saves it
+contains and the saves themselves, one after another.
+"""
+import mmap
+import struct
+
+import entities
+import levels
+import pathfinding
+
+
+MAGIC = b"CRLS"
+ARCHIVE_MAGIC = b"CRLA"
+LEVEL_MAGIC = b"CRLV"
+VERSION = 2
+SAVE_FILE = "corporate.sav"
+# Seeds which fit in the headers (see also replay).
+SEED_RANGE = range(-2 ** 63, 2 ** 63)
+
+# Kinds of entity records.
+ZOMBIE, BOMB = range(2)
+
+HEADER = struct.Struct("<4sHxxqiiiiiiiiiiiiiiiiiHH")
+LEVEL_HEADER = struct.Struct("<4sHxxiiiiiiiiiiH")
+# Mersenne Twister's state (624 words and the position) and the cached
+# gaussian, if there's one.
+RNG_STATE = struct.Struct("<625I?xxxd")
+ROOM = struct.Struct("<iiiiB3x")
+ENTITY = struct.Struct("<B3xiiiii")
+ARCHIVE_HEADER = struct.Struct("<4sHxxI")
+ARCHIVE_ENTRY = struct.Struct("<QQ")
+
+
+def _pack_rng_state(state):
+    """Pack the state returned by Random.getstate."""
+    version, internal, gauss_next = state
+    if version != 3:
+        raise ValueError("Unsupported random state version: {}".format(
+            version))
+    return RNG_STATE.pack(*internal, gauss_next is not None,
+                          gauss_next or 0.0)
+
+
+def _unpack_rng_state(data, offset):
+    """Unpack the state packed by _pack_rng_state, for Random.setstate."""
+    fields = RNG_STATE.unpack_from(data, offset)
+    gauss_next = fields[-1] if fields[-2] else None
+    return (3, tuple(fields[:-2]), gauss_next)
+
+
+def dumps(game):
+    """Serialize the game's current state.
+
+    Args:
+        game (Game): a started game.
+    Returns:
+        The save as bytes.
+    """
+    level = game.current_level
+    player = game.player
+    others = [creature for creature in level.creatures
+              if creature is not player]
+    player_layer = level.occupants[(player.y, player.x)].index(player)
+
+    header = HEADER.pack(
+        MAGIC, VERSION, game.seed, game.level_num, level.height, level.width,
+        player.y, player.x, player_layer, player.hp, player.max_hp,
+        player.bombs_n, player.max_damage, level.entrance.y, level.entrance.x,
+        level.exit.y, level.exit.x, len(level.rooms), len(others),
+        level.npcs.next_id, len(game.random.names), len(level.random.names))
+
+    parts = [header]
+    parts += [_pack_rng_state(state) for state in game.random.getstate()]
+    parts += _pack_level(level, others)
+    return b"".join(parts)
+
+
+def _pack_level(level, others):
+    """Pack the level's random numbers streams, rooms, terrain, visibility
+    and the given creatures.
+
+    Returns:
+        List of the packed parts.
+    """
+    parts = [_pack_rng_state(state) for state in level.random.getstate()]
+    parts += [ROOM.pack(room.y, room.x, room.h, room.w, room.visible)
+              for room in level.rooms]
+    parts += level.terrain
+    parts += level.visibility
+
+    for creature in others:
+        if isinstance(creature, entities.Bomb):
+            parts.append(ENTITY.pack(BOMB, creature.y, creature.x,
+                                     creature.hp, creature.time_till_blow, 0))
+        else:
+            parts.append(ENTITY.pack(
+                ZOMBIE, creature.y, creature.x, creature.hp,
+                creature.max_damage, level.npcs.ids[creature.index]))
+    return parts
+
+
+def _unpack_level(data, offset, level_num, player, height, width, entrance,
+                  exit_, rooms_n):
+    """Build the level out of its rooms, terrain and visibility, the
+    creatures are left to _unpack_entity.
+
+    Args:
+        data (memoryview): the save.
+        offset (int): offset of the level's rooms in the save.
+        level_num (int): number of the level.
+        player (Player): the player character.
+        height, width (ints): dimensions of the level.
+        entrance, exit_ (tuples of ints): positions of the stairs.
+        rooms_n (int): number of rooms.
+    Returns:
+        Tuple (level, offset of the entities in the save).
+    """
+    rooms = []
+    visible = []
+    for _ in range(rooms_n):
+        y, x, h, w, room_visible = ROOM.unpack_from(data, offset)
+        rooms.append(levels.Room(y, x, h, w))
+        visible.append(bool(room_visible))
+        offset += ROOM.size
+
+    level = levels.Level(level_num, player, height=height, width=width,
+                         generate=False)
+    level.set_layout(rooms, levels.Stairs(*entrance, -1),
+                     levels.Stairs(*exit_, 1))
+    for room, room_visible in zip(rooms, visible):
+        room.visible = room_visible
+
+    for rows in (level.terrain, level.visibility):
+        for row in rows:
+            row[:] = data[offset:offset + width]
+            offset += width
+    return level, offset
+
+
+def _unpack_entity(data, offset, level):
+    """Create the creature stored at the offset, without adding it.
+
+    Returns:
+        Tuple (creature, its id in the NPC store, 0 for bombs).
+    """
+    kind, y, x, hp, aux, id_ = ENTITY.unpack_from(data, offset)
+    if kind == BOMB:
+        creature = entities.Bomb(y, x)
+        creature.time_till_blow = aux
+    elif kind == ZOMBIE:
+        creature = entities.CorporateZombie(y, x, rng=level.random.spawns)
+        creature.max_damage = aux
+    else:
+        raise ValueError("Unknown entity kind: {}".format(kind))
+    creature.hp = hp
+    return creature, id_
+
+
+def _add_entity(level, creature, id_):
+    """Add the creature created by _unpack_entity to the level."""
+    level.add_creature(creature)
+    if isinstance(creature, entities.CorporateZombie):
+        level.npcs.ids[creature.index] = id_
+
+
+def _read_header(data):
+    """Unpack the header of the save, checking its magic and version."""
+    fields = HEADER.unpack_from(data, 0)
+    if fields[0] != MAGIC:
+        raise ValueError("Not a CorporateRL save")
+    if fields[1] != VERSION:
+        raise ValueError("Unsupported save version: {}".format(fields[1]))
+    return fields[2:]
+
+
+def terrain(data):
+    """Get the terrain of the saved level without loading the game.
+
+    Args:
+        data (bytes-like): the save, e.g. a slice of a memory-mapped
+            archive.
+    Returns:
+        Tuple (height, width, memoryview of the tile codes, row-major).
+    """
+    (_, _, height, width, *_, rooms_n, _, _, game_streams_n,
+     level_streams_n) = _read_header(data)
+    start = (HEADER.size + (game_streams_n + level_streams_n) * RNG_STATE.size
+             + rooms_n * ROOM.size)
+    return height, width, memoryview(data)[start:start + height * width]
+
+
+def loads(data, game):
+    """Restore the saved state into the game.
+
+    Args:
+        data (bytes-like): the save.
+        game (Game): a game which hasn't been started, its seed, level and
+            player are overwritten.
+    Returns:
+        The game.
+    """
+    (seed, level_num, height, width, player_y, player_x, player_layer,
+     player_hp, player_max_hp, bombs_n, player_max_damage, entrance_y,
+     entrance_x, exit_y, exit_x, rooms_n, entities_n, next_id,
+     game_streams_n, level_streams_n) = _read_header(data)
+    if (game_streams_n != len(game.random.names)
+            or level_streams_n != len(levels.STREAMS)):
+        raise ValueError("The save has different random numbers streams")
+
+    offset = HEADER.size
+    states = []
+    for _ in range(game_streams_n + level_streams_n):
+        states.append(_unpack_rng_state(data, offset))
+        offset += RNG_STATE.size
+
+    game.seed = seed
+    game.level_num = level_num
+    game.height = height
+    game.width = width
+    player = game.player
+    player.hp, player.max_hp = player_hp, player_max_hp
+    player.bombs_n, player.max_damage = bombs_n, player_max_damage
+    level, offset = _unpack_level(
+        memoryview(data), offset, level_num, player, height, width,
+        (entrance_y, entrance_x), (exit_y, exit_x), rooms_n)
+
+    # Creatures are added in their order, so that they end up in the same
+    # order in the occupancy index and the NPC store, the player goes in
+    # between them on their tile.
+    below_player = 0
+    for _ in range(entities_n):
+        creature, id_ = _unpack_entity(data, offset, level)
+        offset += ENTITY.size
+        if (creature.y, creature.x) == (player_y, player_x):
+            if below_player == player_layer:
+                level.place_player(player_y, player_x)
+            below_player += 1
+        _add_entity(level, creature, id_)
+
+    if below_player <= player_layer:
+        level.place_player(player_y, player_x)
+    level.npcs.next_id = next_id
+    level.flow_field = pathfinding.FlowField(level)
+    game.random.setstate(states[:game_streams_n])
+    level.random.setstate(states[game_streams_n:])
+
+    game.current_level = level
+    game.next_level = None
+    return game
+
+
+def dumps_level(level):
+    """Serialize a level the player hasn't entered, e.g. a freshly
+    generated one.
+
+    Args:
+        level (Level): the level, without the player placed in it.
+    Returns:
+        The level record as bytes.
+    """
+    others = [creature for creature in level.creatures
+              if creature is not level.player]
+    header = LEVEL_HEADER.pack(
+        LEVEL_MAGIC, VERSION, level.level_num, level.height, level.width,
+        level.entrance.y, level.entrance.x, level.exit.y, level.exit.x,
+        len(level.rooms), len(others), level.npcs.next_id,
+        len(level.random.names))
+    return b"".join([header] + _pack_level(level, others))
+
+
+def loads_level(data, player):
+    """Rebuild the level serialized by dumps_level. The level is in the same
+    state it was dumped in, including its random numbers streams, so it plays
+    out the same as the original one.
+
+    Args:
+        data (bytes-like): the level record.
+        player (Player): the player character, placed in the level with
+            Level.place_player when they arrive.
+    Returns:
+        The new Level.
+    """
+    (magic, version, level_num, height, width, entrance_y, entrance_x, exit_y,
+     exit_x, rooms_n, entities_n, next_id,
+     streams_n) = LEVEL_HEADER.unpack_from(data, 0)
+    if magic != LEVEL_MAGIC:
+        raise ValueError("Not a CorporateRL level")
+    if version != VERSION:
+        raise ValueError("Unsupported level version: {}".format(version))
+    if streams_n != len(levels.STREAMS):
+        raise ValueError("The level has different random numbers streams")
+
+    offset = LEVEL_HEADER.size
+    states = []
+    for _ in range(streams_n):
+        states.append(_unpack_rng_state(data, offset))
+        offset += RNG_STATE.size
+
+    level, offset = _unpack_level(
+        memoryview(data), offset, level_num, player, height, width,
+        (entrance_y, entrance_x), (exit_y, exit_x), rooms_n)
+    for _ in range(entities_n):
+        _add_entity(level, *_unpack_entity(data, offset, level))
+        offset += ENTITY.size
+
+    level.npcs.next_id = next_id
+    level.flow_field = pathfinding.FlowField(level)
+    level.random.setstate(states)
+    return level
+
+
+def save(game, path=SAVE_FILE):
+    """Save the game to the file."""
+    with open(path, "wb") as save_file:
+        save_file.write(dumps(game))
+
+
+def load(game, path=SAVE_FILE):
+    """Load the game saved in the file, see loads."""
+    with open(path, "rb") as save_file:
+        return loads(save_file.read(), game)
+
+
+def write_archive(path, saves):
+    """Write many saves into a single archive file.
+
+    Args:
+        path (str): path of the archive.
+        saves (iterable): games or saves returned by dumps.
+    """
+    saves = [save_ if isinstance(save_, bytes) else dumps(save_)
+             for save_ in saves]
+    offset = ARCHIVE_HEADER.size + len(saves) * ARCHIVE_ENTRY.size
+    with open(path, "wb") as archive_file:
+        archive_file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, VERSION,
+                                               len(saves)))
+        for save_ in saves:
+            archive_file.write(ARCHIVE_ENTRY.pack(offset, len(save_)))
+            offset += len(save_)
+        for save_ in saves:
+            archive_file.write(save_)
+
+
+class Archive:
+    """Class representing an archive of saves opened by memory-mapping, so
+    that only the saves which are used are read from the disk.
+
+    Attributes:
+        entries (list): offset and size of every save in the archive.
+    """
+
+    def __init__(self, path):
+        """Opens the archive.
+
+        Args:
+            path (str): path of the archive, see write_archive.
+        """
+        with open(path, "rb") as archive_file:
+            self._map = mmap.mmap(archive_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        magic, version, saves_n = ARCHIVE_HEADER.unpack_from(self._view, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("Not a CorporateRL archive")
+        if version != VERSION:
+            raise ValueError("Unsupported archive version: {}".format(
+                version))
+        self.entries = [ARCHIVE_ENTRY.unpack_from(
+            self._view, ARCHIVE_HEADER.size + idx * ARCHIVE_ENTRY.size)
+                        for idx in range(saves_n)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        """Get the save without copying it.
+
+        Returns:
+            memoryview of the save. It has to be released (or dropped) before
+            the archive is closed.
+        """
+        offset, size = self.entries[idx]
+        return self._view[offset:offset + size]
+
+    def load(self, idx, game):
+        """Load the save with the given index into the game, see loads."""
+        with self[idx] as save_:
+            return loads(save_, game)
+
+    def terrain(self, idx):
+        """Get the terrain of the save with the given index, see terrain.
+
+        Returns:
+            Tuple (height, width, tile codes as bytes) - the tile codes are
+            copied, so they stay valid after the archive is closed.
+        """
+        with self[idx] as save_:
+            height, width, tiles = terrain(save_)
+            with tiles:
+                return height, width, tiles.tobytes()
+
+    def close(self):
+        """Close the archive.
+
+        Raises:
+            BufferError: if views of the saves returned by __getitem__ are
+                still alive.
+        """
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,208 @@
+"""Batched runner stepping many headless CorporateRL games across a pool of
+worker processes."""
+import multiprocessing
+import os
+import random
+
+import environment
+import level_cache
+import levels
+import observation
+
+
+def _detach(observation):
+    """Copy the observation's grid, so that it may be sent to another
+    process.
+
+    Args:
+        observation (dict): observation returned by CorporateEnv.
+    Returns:
+        The same observation with the grid as bytes.
+    """
+    observation["grid"] = observation["grid"].tobytes()
+    return observation
+
+
+def _split(observation):
+    """Separate the observation's grid from the rest of it.
+
+    Args:
+        observation (dict): observation returned by CorporateEnv.
+    Returns:
+        Tuple (grid as bytes, the observation without the grid).
+    """
+    return observation.pop("grid").tobytes(), observation
+
+
+def _worker(remote, seeds, cache_directory):
+    """Main function of a worker process, owning a few environments.
+
+    Every environment has its own random numbers generator, seeded with the
+    given seed, which picks the seeds of the consecutive episodes. Games only
+    use their own random numbers streams, so environments sharing the
+    process don't affect each other.
+
+    Args:
+        remote (Connection): pipe to the VecEnv in the main process.
+        seeds (list of ints): seeds of the environments run by the worker.
+        cache_directory (str): directory of the level cache shared by the
+            environments, None to generate the levels.
+    """
+    cache = None
+    if cache_directory is not None:
+        cache = level_cache.LevelCache(cache_directory)
+    envs = [environment.CorporateEnv(cache) for _ in seeds]
+    rngs = [random.Random(seed) for seed in seeds]
+
+    def new_episode(idx):
+        return envs[idx].reset(rngs[idx].randrange(2 ** 32))
+
+    while True:
+        command, data = remote.recv()
+        if command == "reset":
+            grids = []
+            infos = []
+            for idx in range(len(envs)):
+                grid, rest = _split(new_episode(idx))
+                grids.append(grid)
+                infos.append({"observation": rest})
+            remote.send((b"".join(grids), infos))
+        elif command == "step":
+            grids = []
+            results = []
+            for idx, action in enumerate(data):
+                observation, reward, done, info = envs[idx].step(action)
+                if done:
+                    info["final_observation"] = _detach(observation)
+                    observation = new_episode(idx)
+                grid, info["observation"] = _split(observation)
+                grids.append(grid)
+                results.append((reward, done, info))
+            remote.send((b"".join(grids), results))
+        elif command == "close":
+            remote.close()
+            break
+        else:
+            raise ValueError("Unknown command: {}".format(command))
+
+
+class VecEnv:
+    """Class running a batch of independent environments in worker processes.
+
+    The grids of all environments' observations (see CorporateEnv) are
+    returned stacked in a single bytes object of shape (num_envs, channels,
+    height, width), which may be wrapped without copying, e.g. with
+    numpy.frombuffer(grids, "uint8").reshape(num_envs,
+    *observation_shape). The rest of every observation is kept in
+    info["observation"].
+
+    Finished episodes are reset automatically - the observation returned for
+    them is the first one of the new episode, while the last one is kept,
+    with its grid as bytes, in info["final_observation"].
+
+    Attributes:
+        num_envs (int): number of environments in the batch.
+        observation_shape (tuple of ints): shape (channels, height, width)
+            of a single environment's grid.
+        remotes (list): pipes to the worker processes.
+        processes (list): the worker processes.
+        slices (list): for each worker, the range of environments it runs.
+    """
+
+    def __init__(self, num_envs, seed=0, num_workers=None,
+                 cache_directory=None):
+        """Starts the worker processes.
+
+        Args:
+            num_envs (int): number of environments to run.
+            seed (int): seed from which the seeds of all environments are
+                derived.
+            num_workers (int): number of processes to use, by default one
+                per core (but no more than environments).
+            cache_directory (str): directory of a level cache (see
+                level_cache) the workers load the levels from, None to
+                generate them. The same seed gives the same episodes, so
+                the cache may be filled before evaluation runs.
+        """
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, num_envs))
+
+        self.num_envs = num_envs
+        self.observation_shape = (len(observation.CHANNELS),
+                                  levels.GAME_HEIGHT, levels.GAME_WIDTH)
+        master_rng = random.Random(seed)
+        seeds = [master_rng.randrange(2 ** 32) for _ in range(num_envs)]
+
+        self.slices = []
+        chunk, rest = divmod(num_envs, num_workers)
+        start = 0
+        for worker_idx in range(num_workers):
+            end = start + chunk + (1 if worker_idx < rest else 0)
+            self.slices.append(slice(start, end))
+            start = end
+
+        self.remotes = []
+        self.processes = []
+        for env_slice in self.slices:
+            remote, worker_remote = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_worker,
+                args=(worker_remote, seeds[env_slice], cache_directory),
+                daemon=True)
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+    def reset(self):
+        """Starts new episodes in all environments.
+
+        Returns:
+            Tuple (grids, infos) - the stacked grids of the first
+            observations and a list of infos, one per environment.
+        """
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        grids = []
+        infos = []
+        for remote in self.remotes:
+            worker_grids, worker_infos = remote.recv()
+            grids.append(worker_grids)
+            infos += worker_infos
+        return b"".join(grids), infos
+
+    def step(self, actions):
+        """Makes one step in every environment.
+
+        Args:
+            actions (sequence): one action per environment, see
+                CorporateEnv.step, e.g. a NumPy array of indices in ACTIONS.
+        Returns:
+            Tuple (grids, rewards, dones, infos) - the stacked grids and
+            lists with one reward, done flag and info per environment.
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError("Expected {} actions, got {}".format(
+                self.num_envs, len(actions)))
+
+        for remote, env_slice in zip(self.remotes, self.slices):
+            remote.send(("step", list(actions[env_slice])))
+        grids = []
+        results = []
+        for remote in self.remotes:
+            worker_grids, worker_results = remote.recv()
+            grids.append(worker_grids)
+            results += worker_results
+
+        rewards, dones, infos = zip(*results)
+        return b"".join(grids), list(rewards), list(dones), list(infos)
+
+    def close(self):
+        """Stops the worker processes."""
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.remotes = []
+        self.processes = []